@@ -1,16 +1,472 @@
+import os
 import json
-from urllib.request import Request, urlopen
+import time
+import pickle
+import hashlib
+import threading
+import re
+import codecs
+import numpy as np
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from queue import LifoQueue, Empty
 from datajoint import blob
 from collections import OrderedDict
 
-def request(path, api_key):
-    req = Request('https://nda.seunglab.org/' + path)
-    req.add_header('Authorization', api_key)
+NDA_URL = 'https://nda.seunglab.org/'
+POOL_SIZE = 8
+RETRIES = 3
+BACKOFF = 0.5
+RETRY_STATUS = (429, 500, 502, 503, 504)
+CACHE_BYTES = 1 << 32
+CACHE_TTL = 24 * 3600
+EVICT_TO = 0.9
+STREAM_BYTES = 1 << 20
+BLOCK_ROWS = 1 << 16
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+class RequestError(Exception):
 
-    res = urlopen(req)
+    def __init__(self, path, status, reason):
+        """Non-retryable (or retried out) HTTP error response
+        """
+        Exception.__init__(self, '{0} {1}: {2}'.format(status, reason, path))
+        self.path = path
+        self.status = status
 
-    if (res.info().get_content_type() == 'application/json'):
-        res2 = res.read()
-        return json.loads(res2.decode(res.info().get_param('charset') or 'utf-8'), object_pairs_hook=OrderedDict)
+def decode(content_type, charset, body):
+    """Decode a response body: JSON into OrderedDicts, else a datajoint blob
+    """
+    if content_type == 'application/json':
+        return json.loads(body.decode(charset or 'utf-8'),
+                          object_pairs_hook=OrderedDict)
     else:
-        return blob.unpack(res.read())
+        return blob.unpack(body)
+
+def iter_json_array(fp, chunk_bytes=STREAM_BYTES, encoding='utf-8'):
+    """Yield the elements of a top-level JSON array read from a file object
+
+    The stream is read chunk_bytes at a time & each element is decoded as
+    soon as it is complete, so only one chunk (or one element, if larger)
+    is held in memory. While an element is incomplete, each read doubles
+    the buffered text, so an element larger than chunk_bytes is re-scanned
+    O(log size) times rather than once per chunk. Elements must be
+    separated by single commas; anything else raises ValueError.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder(encoding)()
+    buf = ''
+    pos = 0
+    eof = False
+    state = '['
+    while True:
+        size = chunk_bytes
+        pos = WHITESPACE.match(buf, pos).end()
+        if pos < len(buf):
+            c = buf[pos]
+            if state == '[':
+                if c != '[':
+                    raise ValueError('expected JSON array')
+                state = 'first'
+                pos += 1
+                continue
+            if c == ']' and state != ',':
+                return
+            if state == 'value':
+                if c != ',':
+                    raise ValueError('expected , or ] in JSON array')
+                state = ','
+                pos += 1
+                continue
+            if c in ',]':
+                raise ValueError('expected value in JSON array')
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof:
+                    raise
+            else:
+                # a number cut by the end of the buffer (e.g. 1. of 1.25)
+                # decodes short, so wait until a separator follows it
+                after = WHITESPACE.match(buf, end).end()
+                if eof or (after < len(buf) and buf[after] in ',]'):
+                    yield obj
+                    pos = end
+                    state = 'value'
+                    continue
+            size = max(chunk_bytes, len(buf) - pos)
+        elif eof:
+            raise ValueError('unterminated JSON array')
+        chunk = fp.read(size)
+        eof = not chunk
+        buf = buf[pos:] + text.decode(chunk, final=eof)
+        pos = 0
+
+def iter_blocks(records, fields, dtype=np.int64, block=BLOCK_ROWS):
+    """Yield dicts of numpy columns for consecutive blocks of records
+
+    Only the Python objects of one block of records are alive at a time.
+
+    Args:
+        records: iterable of dicts (or lists, with int fields)
+        fields: keys of the columns; list values become 2D columns
+        dtype: dtype of the columns
+        block: records per block
+    """
+    rows = []
+    for r in records:
+        rows.append(r)
+        if len(rows) == block:
+            yield dict((f, np.array([x[f] for x in rows], dtype=dtype))
+                       for f in fields)
+            rows = []
+    if rows:
+        yield dict((f, np.array([x[f] for x in rows], dtype=dtype))
+                   for f in fields)
+
+def to_columns(records, fields, dtype=np.int64, block=BLOCK_ROWS):
+    """Collect fields of streamed records into numpy columns
+
+    Returns:
+        dict of column arrays keyed by field (see `iter_blocks`)
+    """
+    blocks = list(iter_blocks(records, fields, dtype, block))
+    if not blocks:
+        return dict((f, np.empty(0, dtype=dtype)) for f in fields)
+    return dict((f, np.concatenate([c[f] for c in blocks])) for f in fields)
+
+def write_edge_table(records, fn, fields, block=BLOCK_ROWS):
+    """Write streamed synapse records straight to an edges csv
+
+    Args:
+        records: iterable of dicts (or lists)
+        fn: path of csv, readable by `edges.load_edges`
+        fields: record keys in column order: id, pre, post, centroid, size
+            & optionally pre_centroid, post_centroid (centroids are lists)
+
+    Returns:
+        number of rows written
+    """
+    n = 0
+    with open(fn, 'wb') as f:
+        for c in iter_blocks(records, fields, np.int64, block):
+            np.savetxt(f, np.column_stack([c[k] for k in fields]),
+                       delimiter=',', fmt='%d')
+            n += len(c[fields[0]])
+    return n
+
+def max_age(info, default):
+    """Freshness lifetime in seconds from Cache-Control, else default
+    """
+    for d in (info.get('Cache-Control') or '').split(','):
+        d = d.strip()
+        if d in ('no-cache', 'no-store'):
+            return 0
+        if d.startswith('max-age='):
+            try:
+                return int(d[len('max-age='):])
+            except ValueError:
+                pass
+    return default
+
+class ResponseCache(object):
+
+    def __init__(self, directory, max_bytes=CACHE_BYTES, ttl=CACHE_TTL,
+                 offline=False):
+        """On-disk cache of decoded NDA responses
+
+        Each entry is a pickle of the decoded response plus a small JSON
+        file with its validators (ETag, Last-Modified) & expiry, both named
+        by the hash of the path & API key, so clients with different keys
+        never share entries. Stale entries are revalidated with a
+        conditional request. Reads touch the entry's mtime, & the least
+        recently used entries are evicted once the cache exceeds max_bytes,
+        down to EVICT_TO of it. The total size is tracked as entries are
+        stored, so the directory is only listed when evicting.
+
+        Args:
+            directory: where entries are stored
+            max_bytes: size cap of the cache
+            ttl: seconds an entry stays fresh if the server doesn't say
+            offline: serve every request from the cache, never the network
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.offline = offline
+        self.lock = threading.Lock()
+        self.total = None
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def key(self, path, api_key):
+        h = hashlib.sha1()
+        h.update(hashlib.sha1(api_key.encode('utf-8')).digest())
+        h.update(path.encode('utf-8'))
+        return os.path.join(self.directory, h.hexdigest())
+
+    def meta(self, key):
+        """Validators & expiry of an entry, or None if not cached
+        """
+        try:
+            with open(key + '.json', 'r') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def get(self, key):
+        with open(key + '.pkl', 'rb') as f:
+            value = pickle.load(f)
+        os.utime(key + '.pkl', None)
+        return value
+
+    def put(self, key, value, info):
+        """Store a decoded response with the validators of its headers
+        """
+        age = max_age(info, self.ttl)
+        meta = {'etag': info.get('ETag'),
+                'last_modified': info.get('Last-Modified'),
+                'max_age': age, 'expires': time.time() + age}
+        tmp = key + '.tmp' + str(threading.current_thread().ident)
+        with open(tmp, 'wb') as f:
+            pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+        size = os.path.getsize(tmp)
+        try:
+            size -= os.path.getsize(key + '.pkl')
+        except OSError:
+            pass
+        os.rename(tmp, key + '.pkl')
+        self.refresh(key, meta)
+        with self.lock:
+            if self.total is not None:
+                self.total += size
+            full = self.total is None or self.total > self.max_bytes
+        if full:
+            self.evict()
+
+    def refresh(self, key, meta, info=None):
+        """Rewrite an entry's metadata, e.g. after a 304 response
+
+        A response without Cache-Control keeps the entry's stored lifetime.
+        """
+        if info is not None:
+            age = max_age(info, meta.get('max_age', self.ttl))
+            meta['max_age'] = age
+            meta['expires'] = time.time() + age
+        with open(key + '.json', 'w') as f:
+            json.dump(meta, f)
+
+    def evict(self):
+        """Delete least recently used entries, if over max_bytes, until
+        under EVICT_TO of it
+        """
+        with self.lock:
+            entries = []
+            for fn in os.listdir(self.directory):
+                if fn.endswith('.pkl'):
+                    st = os.stat(os.path.join(self.directory, fn))
+                    entries.append((st.st_mtime, st.st_size, fn[:-4]))
+            total = sum(e[1] for e in entries)
+            target = self.max_bytes if total <= self.max_bytes else \
+                                                int(self.max_bytes * EVICT_TO)
+            for _, size, name in sorted(entries):
+                if total <= target:
+                    break
+                for ext in ('.pkl', '.json'):
+                    try:
+                        os.remove(os.path.join(self.directory, name + ext))
+                    except OSError:
+                        pass
+                total -= size
+            self.total = total
+
+class Client(object):
+
+    def __init__(self, api_key, base_url=NDA_URL, pool_size=POOL_SIZE,
+                 retries=RETRIES, backoff=BACKOFF, timeout=60, cache=None):
+        """NDA API client reusing keep-alive connections across requests
+
+        Idle connections are kept in a pool, so consecutive & concurrent
+        requests skip the TCP/TLS handshake. Connection failures & 429/5xx
+        responses are retried with exponential backoff.
+
+        Args:
+            api_key: value of the Authorization header
+            base_url: API root (e.g. a local server, for testing)
+            pool_size: max idle connections kept & default batch concurrency
+            retries: attempts after the first before giving up
+            backoff: seconds before the first retry, doubled after each
+            timeout: socket timeout in seconds
+            cache: ResponseCache, or None to always fetch
+        """
+        self.api_key = api_key
+        url = urlsplit(base_url)
+        self.scheme = url.scheme
+        self.host = url.netloc
+        self.prefix = url.path if url.path.endswith('/') else url.path + '/'
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.cache = cache
+        self.idle = LifoQueue(pool_size)
+        self.lock = threading.Lock()
+        self.n_connections = 0
+
+    def _connect(self):
+        try:
+            return self.idle.get_nowait()
+        except Empty:
+            pass
+        cls = HTTPSConnection if self.scheme == 'https' else HTTPConnection
+        with self.lock:
+            self.n_connections += 1
+        return cls(self.host, timeout=self.timeout)
+
+    def _release(self, conn):
+        try:
+            self.idle.put_nowait(conn)
+        except Exception:
+            conn.close()
+
+    def _open(self, path, headers=None):
+        """GET path, retrying; return (connection, response), body unread
+
+        Statuses other than 200 & 304 raise RequestError.
+        """
+        h = {'Authorization': self.api_key}
+        h.update(headers or {})
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            conn = self._connect()
+            try:
+                conn.request('GET', self.prefix + path, headers=h)
+                res = conn.getresponse()
+            except (HTTPException, OSError):
+                conn.close()
+                if last:
+                    raise
+            else:
+                if res.status in (200, 304):
+                    return conn, res
+                res.read()
+                self._done(conn, res)
+                if last or res.status not in RETRY_STATUS:
+                    raise RequestError(path, res.status, res.reason)
+            time.sleep(delay)
+            delay *= 2
+
+    def _done(self, conn, res):
+        """Return connection to the pool if its response was read to the end
+        """
+        if res.will_close or not res.isclosed():
+            conn.close()
+        else:
+            self._release(conn)
+
+    def fetch(self, path, headers=None):
+        """GET path, retrying; return (status, response headers, raw body)
+        """
+        conn, res = self._open(path, headers)
+        try:
+            body = res.read()
+        finally:
+            self._done(conn, res)
+        return res.status, res.msg, body
+
+    def stream(self, path, chunk_bytes=STREAM_BYTES):
+        """GET path & yield the records of its JSON array as they arrive
+
+        The body is parsed incrementally (see `iter_json_array`), so memory
+        stays flat however large the response. Records are plain dicts.
+        """
+        conn, res = self._open(path)
+        try:
+            charset = res.msg.get_param('charset') or 'utf-8'
+            for record in iter_json_array(res, chunk_bytes, charset):
+                yield record
+        finally:
+            self._done(conn, res)
+
+    def request(self, path):
+        """GET path & decode the response (see `decode`)
+
+        With a cache, fresh entries are returned without a request & stale
+        ones are revalidated; in offline mode, anything cached is returned.
+        """
+        if self.cache is None:
+            status, info, body = self.fetch(path)
+            return decode(info.get_content_type(), info.get_param('charset'),
+                          body)
+        key = self.cache.key(path, self.api_key)
+        meta = self.cache.meta(key)
+        if self.cache.offline:
+            if meta is None:
+                raise KeyError('not in NDA cache (offline): ' + path)
+            return self.cache.get(key)
+        headers = {}
+        if meta is not None:
+            if meta['expires'] > time.time():
+                return self.cache.get(key)
+            if meta['etag']:
+                headers['If-None-Match'] = meta['etag']
+            if meta['last_modified']:
+                headers['If-Modified-Since'] = meta['last_modified']
+        status, info, body = self.fetch(path, headers)
+        if status == 304 and meta is not None:
+            self.cache.refresh(key, meta, info)
+            return self.cache.get(key)
+        value = decode(info.get_content_type(), info.get_param('charset'), body)
+        self.cache.put(key, value, info)
+        return value
+
+    def request_many(self, paths, max_workers=None):
+        """Fetch many paths concurrently on a bounded thread pool
+
+        Returns:
+            list of decoded responses, in the order of paths
+        """
+        with ThreadPoolExecutor(max_workers or self.pool_size) as pool:
+            return list(pool.map(self.request, paths))
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except Empty:
+                return
+
+clients = {}
+clients_lock = threading.Lock()
+shared_cache = None
+
+def enable_cache(directory, max_bytes=CACHE_BYTES, ttl=CACHE_TTL,
+                 offline=False):
+    """Cache the responses of `request` on disk (see `ResponseCache`)
+    """
+    global shared_cache
+    shared_cache = ResponseCache(directory, max_bytes, ttl, offline)
+    with clients_lock:
+        for c in clients.values():
+            c.cache = shared_cache
+
+def get_client(api_key):
+    """Shared Client per API key, so `request` reuses connections
+    """
+    with clients_lock:
+        if api_key not in clients:
+            clients[api_key] = Client(api_key, cache=shared_cache)
+        return clients[api_key]
+
+def request(path, api_key):
+    return get_client(api_key).request(path)
+
+def request_many(paths, api_key, max_workers=None):
+    return get_client(api_key).request_many(paths, max_workers)
+
+def request_stream(path, api_key, chunk_bytes=STREAM_BYTES):
+    """Yield records of a large JSON array response (see `Client.stream`)
+    """
+    return get_client(api_key).stream(path, chunk_bytes)
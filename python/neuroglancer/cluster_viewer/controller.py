@@ -1,12 +1,6 @@
 import sys
 from os.path import expanduser, join
 
-import threading
-from tornado import web, ioloop, httpserver
-from sockjs.tornado import SockJSConnection, SockJSRouter
-import json
-from collections import OrderedDict
-
 url = "https://neuromancer-seung-import.appspot.com/#!{'layers':{'image':{'type':'image'_'source':'precomputed://glance://s1_v0/image'}_'segmentation':{'type':'segmentation'_'source':'precomputed://glance://s1_v0/segmentation_0.2'_'selectedAlpha':0.44}}_'navigation':{'pose':{'position':{'voxelSize':[6_6_30]_'voxelCoordinates':[7648.091796875_4767.28564453125_1267.79638671875]}}_'zoomFactor':2.7094874095355532}_'layout':'xy-3d'_'perspectiveOrientation':[-0.4056483507156372_-0.5968747735023499_-0.42320775985717773_0.5478002429008484]_'perspectiveZoom':443.6340451771268_'showSlices':false_'stateURL':'https://localhost:9999'}"
 print(url)
 
@@ -15,11 +9,7 @@ sys.path.append("../neuroglancer")
 from model import Model
 from ui import UI
 import edges
-
-clients = set()
-n_messages = 0
-current_state = None
-receiving_message = False
+from state_server import StateServer
 
 assert len(sys.argv) > 3
 edges_fn = sys.argv[1]
@@ -28,15 +18,14 @@ syn_label_fn = sys.argv[3]
 model = Model(edges_fn, seg_label_fn, syn_label_fn)
 
 # In order for the webbrowser to connect to this server
-# add to the url 'stateURL':'http://localhost:9999'
-def broadcast():
-    """
-    Use this method to broadcast a new state to all connected clients.
-    Without the need to wait for an `on_state_change`.
-    """
-    # global receiving_message
-    # if not receiving_message:
-    router.broadcast(clients.copy(), json.dumps(current_state))
+# add to the url 'stateURL':'https://localhost:9999'
+server = StateServer(9999)
+session = server.session()
+
+@session.add_handler
+def on_message(state, first):
+    if first:
+        print('state initialized')
 
 class Controller:
     """Handles button presses and text entries, makes calls to update Tkinter ui
@@ -66,7 +55,7 @@ class Controller:
     def update_display(self):
         syn = self.update_synapses()
         segs = self.update_segments()
-        broadcast()
+        session.broadcast()
         return syn, segs
 
     def set_segment(self, seg_id):
@@ -94,25 +83,27 @@ class Controller:
         return self.synapses
 
     def get_segments(self):
-        if 'segments' in current_state['layers']['segmentation']:
-            return map(int, current_state['layers']['segmentation']['segments'])
+        if 'segments' in session.state['layers']['segmentation']:
+            return map(int, session.state['layers']['segmentation']['segments'])
         else:
             return []
 
     def display_coords(self, coords):
         self.set_coords(coords)
-        broadcast()
+        session.broadcast()
 
     def display_segments(self, segments):
         self.set_segments(segments)
-        broadcast()
+        session.broadcast()
 
     def set_coords(self, coords):
-        current_state['layers']['synapses'] = {'type':'point', \
+        with session.lock:
+            session.state['layers']['synapses'] = {'type':'point', \
                                                         'points':coords}
 
     def set_segments(self, segs):
-        current_state['layers']['segmentation']['segments'] = segs
+        with session.lock:
+            session.state['layers']['segmentation']['segments'] = segs
 
     def update_segments(self):
         segments = [model.get_segment_id()]
@@ -143,7 +134,8 @@ class Controller:
 
     def set_voxelCoordinates(self, new_pos):
         """Set the voxelCoordinates to the numpy list"""
-        current_state['navigation']['pose']['position']['voxelCoordinates'] = new_pos
+        with session.lock:
+            session.state['navigation']['pose']['position']['voxelCoordinates'] = new_pos
         
     # def next_segment(self):
     #     seg_id = model.next_segment()
@@ -159,77 +151,5 @@ class Controller:
     def shutdown(evt):
         raise NotImplementedError
 
-# websockets connections
-class Connection(SockJSConnection):
-    def on_open(self, info):
-        """
-        info is an object which contains caller IP address, query string
-        parameters and cookies associated with this request"""
-        # When new client comes in, will add it to the clients list
-        clients.add(self)
-
-    def on_message(self, json_state):
-        """
-        This will call initialize_state or on_state_change depening on if it is
-        the first message recieved.
-        """
-        global receiving_message
-        receiving_message = True
-        global current_state
-        current_state = json.JSONDecoder(object_pairs_hook=OrderedDict).decode(json_state)
-        global n_messages
-
-        if not n_messages: #first message ever
-            new_state = self.initialize_state(current_state)
-        else:
-            new_state = self.on_state_change(current_state)
-
-        n_messages += 1
-        if new_state: #if you return a new state send it back
-            receiving_message = False
-
-
-    def on_close(self):
-        # If client disconnects, remove him from the clients list
-        clients.remove(self)
-
-    def initialize_state(self, state):
-        """
-        This is called once the connection is stablished
-        """
-        print 'state initialized'
-        return state
-
-    def on_state_change(self, state):
-        """
-        This is called every time there is a new state available
-        (except the very first time).
-        """
-        return state
-
-
-# Tornado & Tk need to run on separate threads
-class TornadoThread(threading.Thread):
-    def __init__(self):
-        # super(TornadoThread, self).__init__()
-        # self._stop = threading.Event()
-        threading.Thread.__init__(self)
-        self.daemon = True
-
-        socketApp = web.Application(router.urls)
-        http_server = httpserver.HTTPServer(socketApp, ssl_options={
-            "certfile": "./certificate.crt",
-            "keyfile": "./privateKey.key",
-        })
-        http_server.bind(9999) #port
-        http_server.start(1)
-
-    def run(self):
-        print("IOLoop starting")
-        ioloop.IOLoop.instance().start()
-
-
-router = SockJSRouter(Connection)
-TornadoThread = TornadoThread()
-TornadoThread.start()
+server.start()
 c = Controller()
\ No newline at end of file
@@ -1,4 +1,5 @@
 import edges
+from columnar_edges import ColumnarEdges
 import copy
 import h5py
 import numpy as np
@@ -124,8 +125,8 @@ class Model(object):
         """Reads data from csv file, filename, and processes it into dict
         """
         offset = np.array([17409,16385,16385])
-        e = edges.load_edges(edges_fn, offset=offset)
-        self.edge_dict = edges.create_edge_dict(e)
+        e = ColumnarEdges(edges_fn, edges_fn, offset=offset, cache=True)
+        self.edge_dict = e.edge_dict()
         segs = self.edge_dict['seg_to_neighbors'].keys()
         syns = self.edge_dict['syn_to_segs'].keys()
         label_to_segs, seg_to_label = edges.load_labels(seg_label_fn, 
@@ -143,8 +144,7 @@ class Model(object):
 
     def create_segment_list(self):
         """Creates a list of unique segments in edge_dict"""
-        self.segments = self.edge_dict['seg_to_syn'].keys()
-        self.segments.sort()
+        self.segments = sorted(self.edge_dict['seg_to_syn'].keys())
 
     def next_segment(self):
         """Returns next synapse ID in list of synapses"""
@@ -0,0 +1,122 @@
+import numpy as np
+from edges import load_table
+from columnar_edges import csr_index
+
+SAMPLE_SIZE = 20
+ROUNDS = 4
+MIX = np.uint64(0x9E3779B97F4A7C15)
+
+class ClusterIndex(object):
+
+    def __init__(self, ids, labels):
+        """Members of each cluster as one array, CSR-style (see
+        `columnar_edges.csr_index`), built once so showing a cluster doesn't
+        copy its members
+
+        Args:
+            ids: 1D array of segment IDs
+            labels: 1D array of their cluster IDs
+
+        Attributes:
+            clusters: sorted cluster IDs
+            ptr: members of clusters[i] are members[ptr[i]:ptr[i+1]]
+            members: segment IDs sorted by cluster (file order within one)
+        """
+        ids = np.asarray(ids)
+        self.clusters, self.ptr, rows = csr_index(np.asarray(labels))
+        self.members = ids[rows]
+
+    def __len__(self):
+        return len(self.clusters)
+
+    def __contains__(self, k):
+        i = np.searchsorted(self.clusters, k)
+        return i < len(self.clusters) and self.clusters[i] == k
+
+    def span(self, k):
+        i = np.searchsorted(self.clusters, k)
+        if i == len(self.clusters) or self.clusters[i] != k:
+            raise KeyError(k)
+        return int(self.ptr[i]), int(self.ptr[i+1])
+
+    def size(self, k):
+        start, end = self.span(k)
+        return end - start
+
+    def __getitem__(self, k):
+        """Members of cluster k (a view, not a copy)
+        """
+        start, end = self.span(k)
+        return self.members[start:end]
+
+    def sample_size(self, k, size=SAMPLE_SIZE, fraction=None):
+        """Number of members shown per page: fraction of the cluster (at
+        least 1) if given, else size
+        """
+        n = self.size(k)
+        if fraction is not None:
+            size = max(1, int(round(fraction * n)))
+        return min(size, n)
+
+    def pages(self, k, size=SAMPLE_SIZE, fraction=None):
+        m = self.sample_size(k, size, fraction)
+        return -(-self.size(k) // m) if m else 0
+
+    def shuffle(self, k, j, seed=0):
+        """Entries j of a seeded permutation of the positions of cluster k's
+        members, in O(len(j)) without materializing the permutation
+
+        The permutation is a Feistel network over the next even power of
+        two above the cluster size, keyed by seed & k, with cycle-walking
+        back into range.
+        """
+        n = self.size(k)
+        half = max(1, (int(n - 1).bit_length() + 1) // 2)
+        k = int(k)
+        rs = np.random.RandomState([seed & 0xffffffff, k & 0xffffffff,
+                                    (k >> 32) & 0xffffffff])
+        keys = rs.randint(0, 1 << 31, ROUNDS).astype(np.uint64)
+        x = np.asarray(j, dtype=np.uint64)
+        out = feistel(x, keys, half)
+        walk = np.flatnonzero(out >= n)
+        while len(walk):
+            out[walk] = feistel(out[walk], keys, half)
+            walk = walk[out[walk] >= n]
+        return out.astype(np.int64)
+
+    def sample(self, k, size=SAMPLE_SIZE, fraction=None, page=0, seed=0):
+        """Page of a seeded shuffle of cluster k's members, in O(m)
+
+        Consecutive pages don't repeat members & together cover the
+        cluster; the same seed & page give the same sample. Pages wrap
+        around (see `pages`).
+
+        Returns:
+            1D array of up to m segment IDs
+        """
+        cluster = self[k]
+        m = self.sample_size(k, size, fraction)
+        if m == 0:
+            return cluster[:0]
+        start = (page % self.pages(k, size, fraction)) * m
+        j = np.arange(start, min(start + m, len(cluster)))
+        return cluster[self.shuffle(k, j, seed)]
+
+def feistel(x, keys, half):
+    """Bijection on [0, 4**half): one Feistel round per key
+    """
+    mask = np.uint64((1 << half) - 1)
+    shift = np.uint64(half)
+    left = x >> shift
+    right = x & mask
+    for key in keys:
+        f = (right ^ key) * MIX
+        f = (f ^ (f >> np.uint64(29))) & mask
+        left, right = right, left ^ f
+    return (left << shift) | right
+
+def load_cluster_index(fn, delimiter=',', id_col=0, label_col=1):
+    """ClusterIndex of an ID list with cluster IDs (see `edges.load_labels`)
+    """
+    d = load_table(fn, delimiter=delimiter)
+    return ClusterIndex(d[:,id_col], d[:,label_col])
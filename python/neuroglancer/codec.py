@@ -0,0 +1,109 @@
+import sys
+import json
+import time
+from collections import OrderedDict
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+class Codec(object):
+
+    def __init__(self, name, loads, dumps):
+        """JSON codec for state messages
+
+        Attributes:
+            name: key in CODECS
+            loads: function decoding a JSON string
+            dumps: function encoding an object to a JSON string
+        """
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+
+def stdlib_codec(ordered=False):
+    """json module codec, with one decoder & encoder reused for all messages
+
+    Neuroglancer doesn't depend on key order, so plain dicts are decoded
+    unless ordered is set.
+    """
+    if ordered:
+        decoder = json.JSONDecoder(object_pairs_hook=OrderedDict)
+        name = 'json-ordered'
+    else:
+        decoder = json.JSONDecoder()
+        name = 'json'
+    return Codec(name, decoder.decode, json.JSONEncoder().encode)
+
+CODECS = {}
+for c in [stdlib_codec(), stdlib_codec(ordered=True)]:
+    CODECS[c.name] = c
+if orjson is not None:
+    CODECS['orjson'] = Codec('orjson', orjson.loads, lambda o:
+            orjson.dumps(o, option=orjson.OPT_SERIALIZE_NUMPY).decode('utf-8'))
+if ujson is not None:
+    CODECS['ujson'] = Codec('ujson', ujson.loads, ujson.dumps)
+
+# fastest available first
+PREFERENCE = ['orjson', 'ujson', 'json']
+codec = CODECS[[k for k in PREFERENCE if k in CODECS][0]]
+
+def use(name):
+    """Select the codec used by `loads` & `dumps` (see CODECS)
+    """
+    global codec
+    codec = CODECS[name]
+    return codec
+
+def loads(s):
+    return codec.loads(s)
+
+def dumps(obj):
+    return codec.dumps(obj)
+
+def read_messages(fn):
+    """Recorded state messages, one JSON message per line (see
+    `state_server.Session` record option)
+    """
+    with open(fn, 'r') as f:
+        return [line.rstrip('\n') for line in f if line.strip()]
+
+def benchmark(messages, repeat=5):
+    """Time decoding & re-encoding messages with every available codec
+
+    Returns:
+        dict of codec name -> (decode ms/message, encode ms/message)
+    """
+    n = max(1, len(messages))
+    results = {}
+    for name in sorted(CODECS):
+        c = CODECS[name]
+        decoded = [c.loads(m) for m in messages]
+        t = time.time()
+        for _ in range(repeat):
+            for m in messages:
+                c.loads(m)
+        dt_load = (time.time() - t) / repeat / n
+        t = time.time()
+        for _ in range(repeat):
+            for d in decoded:
+                c.dumps(d)
+        dt_dump = (time.time() - t) / repeat / n
+        results[name] = (dt_load * 1000, dt_dump * 1000)
+    return results
+
+if __name__ == '__main__':
+    # python codec.py recorded_messages.jsonl
+    assert len(sys.argv) > 1
+    messages = read_messages(sys.argv[1])
+    mb = sum(len(m) for m in messages) / float(1 << 20)
+    print('{0} messages, {1:.1f} MB'.format(len(messages), mb))
+    for name, (load, dump) in sorted(benchmark(messages).items(),
+                                     key=lambda x: sum(x[1])):
+        print('{0:>14}: decode {1:.3f} ms, encode {2:.3f} ms per message'
+              .format(name, load, dump))
@@ -0,0 +1,415 @@
+import numpy as np
+from edges import Edges, Adjacency, load_edge_columns, save_edge_columns
+import edge_cache
+from undo_log import UNDO_BYTES
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+COLUMNS = ['id', 'pre', 'post', 'centroid', 'size', 'pre_centroid',
+                                                            'post_centroid']
+
+def split_columns(e):
+    """Split an edges array into named columns (see `Edges.load` for format)
+
+    Args:
+        e: NxM numpy array of edges, M >= 7
+
+    Returns:
+        dict of contiguous column arrays: id, pre, post, centroid, size,
+        pre_centroid, post_centroid
+    """
+    e = np.atleast_2d(e)
+    columns = {}
+    columns['id'] = np.ascontiguousarray(e[:,0], dtype=np.int64)
+    columns['pre'] = np.ascontiguousarray(e[:,1], dtype=np.int64)
+    columns['post'] = np.ascontiguousarray(e[:,2], dtype=np.int64)
+    columns['centroid'] = np.ascontiguousarray(e[:,3:6], dtype=np.int32)
+    columns['size'] = np.ascontiguousarray(e[:,6], dtype=np.int64)
+    if e.shape[1] > 7:
+        columns['pre_centroid'] = np.ascontiguousarray(e[:,7:10],
+                                                            dtype=np.int32)
+        columns['post_centroid'] = np.ascontiguousarray(e[:,10:13],
+                                                            dtype=np.int32)
+    else:
+        columns['pre_centroid'] = columns['centroid'].copy()
+        columns['post_centroid'] = columns['centroid'].copy()
+    return columns
+
+def csr_index(keys):
+    """Group row indices by key, CSR-style
+
+    Args:
+        keys: 1D numpy array of keys (one per row)
+
+    Returns:
+        uniq: sorted unique keys
+        ptr: rows of uniq[i] are rows[ptr[i]:ptr[i+1]]
+        rows: row indices sorted by key (stable, so file order is kept)
+    """
+    rows = np.argsort(keys, kind='mergesort')
+    uniq, start = np.unique(keys[rows], return_index=True)
+    ptr = np.append(start, len(keys)).astype(np.int64)
+    return uniq, ptr, rows
+
+def pair_index(pre, post):
+    """Group row indices by (pre, post) pair, CSR-style
+
+    Returns:
+        uniq_pre, uniq_post: pairs sorted lexicographically
+        ptr, rows: as in `csr_index`
+    """
+    rows = np.lexsort((post, pre))
+    sp, so = pre[rows], post[rows]
+    change = (sp[1:] != sp[:-1]) | (so[1:] != so[:-1])
+    start = np.concatenate(([0], np.flatnonzero(change) + 1)) if len(rows) \
+                                            else np.zeros(0, dtype=np.int64)
+    ptr = np.append(start, len(rows)).astype(np.int64)
+    return sp[start], so[start], ptr, rows
+
+def build_indices(columns):
+    """Compute the sorted lookup arrays of a set of edge columns
+
+    Returns:
+        flat dict of index arrays, so they can be cached next to the columns
+    """
+    ids = columns['id']
+    indices = {}
+    indices['id_rows'] = np.argsort(ids, kind='mergesort')
+    indices['sorted_ids'] = ids[indices['id_rows']]
+    for side in ['pre', 'post']:
+        uniq, ptr, rows = csr_index(columns[side])
+        indices[side + '_uniq'] = uniq
+        indices[side + '_ptr'] = ptr
+        indices[side + '_rows'] = rows
+    uniq_pre, uniq_post, ptr, rows = pair_index(columns['pre'], 
+                                                            columns['post'])
+    indices['pair_pre'] = uniq_pre
+    indices['pair_post'] = uniq_post
+    indices['pair_ptr'] = ptr
+    indices['pair_rows'] = rows
+    return indices
+
+class EdgeView(Mapping):
+
+    def __init__(self, lookup, keys):
+        """Read-only dict facade over a ColumnarEdges lookup
+
+        Args:
+            lookup: function of key, returns value or None if key is absent
+            keys: function returning a list of all present keys
+        """
+        self._lookup = lookup
+        self._keys = keys
+
+    def __getitem__(self, k):
+        v = self._lookup(k)
+        if v is None:
+            raise KeyError(k)
+        return v
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __len__(self):
+        return len(self._keys())
+
+class ColumnarEdges(Edges):
+
+    def __init__(self, src_fn, dst_fn, offset=np.array([0,0,0]), cache=False,
+                                    journaled=False, undo_bytes=UNDO_BYTES):
+        """Edges backed by contiguous numpy columns instead of dictionaries
+
+        Synapses loaded from the table are stored once, in `columns`, with
+        sorted CSR indices for pre->syns, post->syns and (pre,post)->syns.
+        Synapses added afterwards go to a small dict overlay, and removed
+        synapses are masked out in `alive`, so edits never copy the columns.
+        `compact` folds the overlay back into the columns.
+
+        The dict attributes of `Edges` (syn_to_pre_seg, pre_to_syns, ...) are
+        kept as read-only views, so `Segment` objects work unchanged.
+
+        With cache set, columns & indices are kept in a binary sidecar next
+        to src_fn, and memory-mapped read-only on later loads.
+
+        Attributes:
+            columns: dict of column arrays (see `split_columns`)
+            alive: boolean mask of column rows that have not been removed
+            added: synapse ID to row tuple, for synapses added since load
+        """
+        Edges.__init__(self, src_fn, dst_fn, offset, cache, journaled,
+                                                                undo_bytes)
+
+    def load(self):
+        """Load edges csv into numpy columns (see `Edges.load` for format)
+        """
+        if not self.cache:
+            self.set_columns(load_edge_columns(self.src_fn, self.offset))
+            return
+        def build():
+            columns = load_edge_columns(self.src_fn, self.offset)
+            arrays = build_indices(columns)
+            arrays.update(columns)
+            return arrays
+        arrays = edge_cache.load_cached(self.src_fn, 'columnar', build,
+                                    extra=np.asarray(self.offset).tolist())
+        columns = dict((k, arrays.pop(k)) for k in COLUMNS)
+        self.set_columns(columns, arrays)
+
+    def set_columns(self, columns, indices=None):
+        """Replace storage with new columns, rebuilding indices & views
+
+        Args:
+            columns: dict of column arrays
+            indices: precomputed `build_indices(columns)`, e.g. from cache
+        """
+        if indices is None:
+            indices = build_indices(columns)
+        self.columns = columns
+        ids = columns['id']
+        self.alive = np.ones(len(ids), dtype=bool)
+        self.added = {}
+        self._added_pre = Adjacency()
+        self._added_post = Adjacency()
+        self._added_pair = Adjacency()
+        self._id_rows = indices['id_rows']
+        self._sorted_ids = indices['sorted_ids']
+        self._pre_index = (indices['pre_uniq'], indices['pre_ptr'],
+                                                        indices['pre_rows'])
+        self._post_index = (indices['post_uniq'], indices['post_ptr'],
+                                                        indices['post_rows'])
+        self._pair_index = (indices['pair_pre'], indices['pair_post'],
+                                    indices['pair_ptr'], indices['pair_rows'])
+        self.max_syn = int(ids.max()) if len(ids) else 0
+        self._create_views()
+
+    def _create_views(self):
+        self.syn_to_pre_seg = EdgeView(lambda s: self._syn_field(s, 1),
+                                                            self._syn_keys)
+        self.syn_to_post_seg = EdgeView(lambda s: self._syn_field(s, 2),
+                                                            self._syn_keys)
+        self.syn_coords = EdgeView(lambda s: self._syn_field(s, 3),
+                                                            self._syn_keys)
+        self.syn_size = EdgeView(lambda s: self._syn_field(s, 4),
+                                                            self._syn_keys)
+        self.syn_coords_pre_post = EdgeView(self._syn_pre_post,
+                                                            self._syn_keys)
+        self.pre_to_syns = EdgeView(lambda k: self._seg_syns(k, 'pre'),
+                                            lambda: self._seg_keys('pre'))
+        self.post_to_syns = EdgeView(lambda k: self._seg_syns(k, 'post'),
+                                            lambda: self._seg_keys('post'))
+        self.pre_to_post = EdgeView(lambda k: self._seg_partners(k, 'pre'),
+                                            lambda: self._seg_keys('pre'))
+        self.post_to_pre = EdgeView(lambda k: self._seg_partners(k, 'post'),
+                                            lambda: self._seg_keys('post'))
+        self.segs_to_syn = EdgeView(self._pair_syns, self._pair_keys)
+
+    def _row(self, syn):
+        """Return column row of live synapse, or -1
+        """
+        i = np.searchsorted(self._sorted_ids, syn)
+        if i < len(self._sorted_ids) and self._sorted_ids[i] == syn:
+            row = self._id_rows[i]
+            if self.alive[row]:
+                return row
+        return -1
+
+    def _row_tuple(self, row):
+        c = self.columns
+        return (int(c['id'][row]), int(c['pre'][row]), int(c['post'][row]),
+                c['centroid'][row].tolist(), int(c['size'][row]),
+                c['pre_centroid'][row].tolist(),
+                c['post_centroid'][row].tolist())
+
+    def _syn_tuple(self, syn):
+        if syn in self.added:
+            return self.added[syn]
+        row = self._row(syn)
+        if row < 0:
+            return None
+        return self._row_tuple(row)
+
+    def _syn_field(self, syn, k):
+        t = self._syn_tuple(syn)
+        return None if t is None else t[k]
+
+    def _syn_pre_post(self, syn):
+        t = self._syn_tuple(syn)
+        return None if t is None else [t[5], t[6]]
+
+    def _syn_keys(self):
+        ids = self.columns['id'][self.alive].tolist()
+        return ids + list(self.added.keys())
+
+    def _index_rows(self, index, k):
+        uniq, ptr, rows = index
+        i = np.searchsorted(uniq, k)
+        if i < len(uniq) and uniq[i] == k:
+            r = rows[ptr[i]:ptr[i+1]]
+            return r[self.alive[r]]
+        return rows[:0]
+
+    def _seg_syns(self, seg, side):
+        index = self._pre_index if side == 'pre' else self._post_index
+        overlay = self._added_pre if side == 'pre' else self._added_post
+        syns = self.columns['id'][self._index_rows(index, seg)].tolist()
+        syns += overlay.get(seg, [])
+        return syns if syns else None
+
+    def _seg_partners(self, seg, side):
+        index = self._pre_index if side == 'pre' else self._post_index
+        overlay = self._added_pre if side == 'pre' else self._added_post
+        other = 'post' if side == 'pre' else 'pre'
+        k = 2 if side == 'pre' else 1
+        rows = self._index_rows(index, seg)
+        partners = set(self.columns[other][rows].tolist())
+        partners.update(self.added[s][k] for s in overlay.get(seg, []))
+        return list(partners) if partners else None
+
+    def _seg_keys(self, side):
+        segs = set(np.unique(self.columns[side][self.alive]).tolist())
+        overlay = self._added_pre if side == 'pre' else self._added_post
+        segs.update(overlay.keys())
+        return list(segs)
+
+    def _pair_syns(self, pair):
+        pre, post = pair
+        uniq_pre, uniq_post, ptr, rows = self._pair_index
+        lo = np.searchsorted(uniq_pre, pre, 'left')
+        hi = np.searchsorted(uniq_pre, pre, 'right')
+        i = lo + np.searchsorted(uniq_post[lo:hi], post)
+        syns = []
+        if i < hi and uniq_post[i] == post:
+            r = rows[ptr[i]:ptr[i+1]]
+            syns = self.columns['id'][r[self.alive[r]]].tolist()
+        syns += self._added_pair.get((pre, post), [])
+        return syns if syns else None
+
+    def _pair_keys(self):
+        c = self.columns
+        pairs = set(zip(c['pre'][self.alive].tolist(),
+                        c['post'][self.alive].tolist()))
+        pairs.update(self._added_pair.keys())
+        return list(pairs)
+
+    def _delete(self, syn):
+        """Mask out (or drop from the overlay) the synapse (no logging)
+        """
+        if syn in self.added:
+            _, pre, post = self.added.pop(syn)[:3]
+            self._added_pre.discard(pre, syn)
+            self._added_post.discard(post, syn)
+            self._added_pair.discard((pre, post), syn)
+        else:
+            row = self._row(syn)
+            if row < 0:
+                raise KeyError(syn)
+            self.alive[row] = False
+
+    def _missing(self, syns):
+        """IDs of syns that are not live synapses, found in one vectorized
+        lookup of the column rows
+        """
+        base = np.array([s for s in syns if s not in self.added],
+                                                            dtype=np.int64)
+        i = np.searchsorted(self._sorted_ids, base)
+        found = i < len(self._sorted_ids)
+        found[found] = self._sorted_ids[i[found]] == base[found]
+        found[found] = self.alive[self._id_rows[i[found]]]
+        return base[~found].tolist()
+
+    def _delete_many(self, syns):
+        """Mask out all column rows in one vectorized step (no logging)
+        """
+        base = np.array([s for s in syns if s not in self.added],
+                                                            dtype=np.int64)
+        i = np.searchsorted(self._sorted_ids, base)
+        found = i < len(self._sorted_ids)
+        found[found] = self._sorted_ids[i[found]] == base[found]
+        rows = self._id_rows[i[found]]
+        if not found.all() or not self.alive[rows].all():
+            raise KeyError(base[~found].tolist() or 
+                           self.columns['id'][rows[~self.alive[rows]]].tolist())
+        self.alive[rows] = False
+        for syn in syns:
+            if syn in self.added:
+                self._delete(syn)
+
+    def _insert(self, syn, pre, post, center, size, pre_coord, post_coord):
+        """Add the synapse to the overlay (no logging)
+        """
+        self.added[syn] = (syn, pre, post, list(center), size,
+                                            list(pre_coord), list(post_coord))
+        self._added_pre.add(pre, syn)
+        self._added_post.add(post, syn)
+        self._added_pair.add((pre, post), syn)
+
+    def to_columns(self):
+        """Return columns of all live synapses, with the overlay appended
+        """
+        c = self.columns
+        out = {}
+        for k, v in c.items():
+            out[k] = v[self.alive]
+        if self.added:
+            rows = list(self.added.values())
+            out['id'] = np.append(out['id'], [r[0] for r in rows])
+            out['pre'] = np.append(out['pre'], [r[1] for r in rows])
+            out['post'] = np.append(out['post'], [r[2] for r in rows])
+            out['size'] = np.append(out['size'], [r[4] for r in rows])
+            for k, j in [('centroid', 3), ('pre_centroid', 5),
+                                                    ('post_centroid', 6)]:
+                new = np.array([r[j] for r in rows], dtype=c[k].dtype)
+                out[k] = np.concatenate((out[k], new.reshape(-1, 3)))
+        return out
+
+    def compact(self):
+        """Fold overlay & removals back into contiguous columns
+        """
+        max_syn = self.max_syn
+        self.set_columns(self.to_columns())
+        self.max_syn = max(max_syn, self.max_syn)
+
+    def edge_dict(self):
+        """Views keyed like the edge dict used by `cluster_viewer.model`
+
+        Returns:
+            dict with syn_to_segs, segs_to_syn, seg_to_syn, seg_to_neighbors,
+            seg_prepost, syn_coords
+        """
+        def syn_to_segs(syn):
+            t = self._syn_tuple(syn)
+            return None if t is None else (t[1], t[2])
+
+        def seg_keys():
+            return list(set(self._seg_keys('pre')) |
+                        set(self._seg_keys('post')))
+
+        def seg_to_syn(seg):
+            syns = (self.pre_to_syns.get(seg, []) +
+                    self.post_to_syns.get(seg, []))
+            return syns if syns else None
+
+        def seg_to_neighbors(seg):
+            segs = set(self.pre_to_post.get(seg, []))
+            segs.update(self.post_to_pre.get(seg, []))
+            return list(segs) if segs else None
+
+        def seg_prepost(seg):
+            if seg in self.pre_to_syns:
+                return 0
+            return 1 if seg in self.post_to_syns else None
+
+        return {'syn_to_segs': EdgeView(syn_to_segs, self._syn_keys),
+                'segs_to_syn': self.segs_to_syn,
+                'seg_to_syn': EdgeView(seg_to_syn, seg_keys),
+                'seg_to_neighbors': EdgeView(seg_to_neighbors, seg_keys),
+                'seg_prepost': EdgeView(seg_prepost, seg_keys),
+                'syn_coords': self.syn_coords}
+
+    def write_table(self):
+        """Write live synapses back to edges csv file in one pass
+        """
+        save_edge_columns(self.dst_fn, self.to_columns())
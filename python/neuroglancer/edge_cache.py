@@ -0,0 +1,102 @@
+import numpy as np
+import os
+import json
+import shutil
+import hashlib
+
+CACHE_VERSION = 1
+SAMPLE_BYTES = 1 << 20
+
+def cache_dir(fn, name):
+    """Sidecar directory holding the cached arrays of fn
+    """
+    return fn + '.cache' + os.sep + name
+
+def source_key(fn, extra=None):
+    """Fingerprint of source file: size, mtime & hash of its first/last MB
+
+    Hashing only the ends keeps the check near-instant on multi-GB tables,
+    while size & mtime catch any rewrite that keeps the ends intact.
+
+    Args:
+        fn: path to source file
+        extra: JSON-serializable parameters the cached arrays depend on
+            (e.g. the coordinate offset)
+    """
+    st = os.stat(fn)
+    h = hashlib.sha1()
+    with open(fn, 'rb') as f:
+        h.update(f.read(SAMPLE_BYTES))
+        if st.st_size > SAMPLE_BYTES:
+            f.seek(max(SAMPLE_BYTES, st.st_size - SAMPLE_BYTES))
+            h.update(f.read(SAMPLE_BYTES))
+    return {'version': CACHE_VERSION,
+            'size': st.st_size,
+            'mtime': st.st_mtime,
+            'sha1': h.hexdigest(),
+            'extra': extra}
+
+def read_cache(fn, name, key, mmap_mode='r'):
+    """Open cached arrays if the sidecar matches key, else return None
+    """
+    d = cache_dir(fn, name)
+    meta_fn = os.path.join(d, 'meta.json')
+    if not os.path.exists(meta_fn):
+        return None
+    with open(meta_fn, 'r') as f:
+        meta = json.load(f)
+    if meta['key'] != key:
+        return None
+    arrays = {}
+    for k in meta['arrays']:
+        arrays[k] = np.load(os.path.join(d, k + '.npy'), mmap_mode=mmap_mode)
+    return arrays
+
+def write_cache(fn, name, key, arrays):
+    """Write arrays as raw .npy files plus meta.json into the sidecar
+
+    Files are written to a temporary directory that is renamed into place,
+    so a reader never sees a partial cache.
+    """
+    d = cache_dir(fn, name)
+    tmp = d + '.tmp' + str(os.getpid())
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    for k, v in arrays.items():
+        np.save(os.path.join(tmp, k + '.npy'), np.ascontiguousarray(v))
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump({'key': key, 'arrays': sorted(arrays.keys())}, f)
+    if os.path.exists(d):
+        shutil.rmtree(d)
+    os.rename(tmp, d)
+
+def load_cached(fn, name, build, extra=None, mmap_mode='r'):
+    """Return arrays derived from fn, using the binary sidecar when valid
+
+    On a hit the arrays are memory-mapped read-only, so processes opening
+    the same table share the page cache instead of each parsing a copy. On
+    a miss, build() is called and its arrays are written to the sidecar.
+
+    Args:
+        fn: path to source file
+        name: name of the cached array set (e.g. 'columns')
+        build: function returning dict of numpy arrays
+        extra: parameters the arrays depend on (see `source_key`)
+        mmap_mode: passed to np.load
+
+    Returns:
+        dict of numpy arrays
+    """
+    key = source_key(fn, extra)
+    arrays = read_cache(fn, name, key, mmap_mode)
+    if arrays is not None:
+        print('opened cache ' + cache_dir(fn, name))
+        return arrays
+    arrays = build()
+    try:
+        write_cache(fn, name, key, arrays)
+    except (IOError, OSError) as err:
+        print('could not write cache for ' + fn + ': ' + str(err))
+        return arrays
+    return read_cache(fn, name, key, mmap_mode)
@@ -2,7 +2,26 @@ import numpy as np
 import csv
 import pickle
 import h5py
+import time
+import re
+from collections import OrderedDict
+from io import BytesIO
 from ast import literal_eval as make_tuple
+import edge_cache
+import journal
+from undo_log import UndoLog, ADD, REMOVE, UNDO_BYTES
+from remap import as_remap_table, load_remap
+from multiprocessing import Pool
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+CHUNK_BYTES = 1 << 26
+KDTREE_MIN = 64
+NEAREST_BLOCK = 1 << 22
+BLANK_LINES = re.compile(br'^[ \t\r]+$', re.M)
 
 def push_dict(d, k, v):
     """For dicts with lists, test key, then append to list
@@ -17,18 +36,85 @@ def unique(d):
     for k, v in d.items():
         d[k] = list(set(v))
 
+class Adjacency(object):
+
+    def __init__(self):
+        """Dict of key to neighbors with O(1) add, remove & membership
+
+        Replaces the dict-of-lists indices of `Edges`. Each key holds an
+        insertion-ordered dict of neighbor to multiplicity, so a neighbor
+        added n times (e.g. one seg pair with n synapses) is only dropped
+        after n removals. Lookups return lists, like the dict-of-lists did.
+        Keys whose last neighbor is removed are dropped.
+        """
+        self.d = {}
+
+    def add(self, k, v):
+        n = self.d.get(k)
+        if n is None:
+            n = self.d[k] = {}
+        n[v] = n.get(v, 0) + 1
+
+    def discard(self, k, v):
+        """Decrement neighbor count, return True if v is no longer a neighbor
+        """
+        n = self.d[k]
+        c = n[v] - 1
+        if c:
+            n[v] = c
+            return False
+        del n[v]
+        if not n:
+            del self.d[k]
+        return True
+
+    def count(self, k, v):
+        return self.d.get(k, {}).get(v, 0)
+
+    def __getitem__(self, k):
+        return list(self.d[k])
+
+    def get(self, k, default=None):
+        return list(self.d[k]) if k in self.d else default
+
+    def __contains__(self, k):
+        return k in self.d
+
+    def __iter__(self):
+        return iter(self.d)
+
+    def __len__(self):
+        return len(self.d)
+
+    def keys(self):
+        return list(self.d.keys())
+
+    def values(self):
+        return [list(n) for n in self.d.values()]
+
+    def items(self):
+        return [(k, list(n)) for k, n in self.d.items()]
+
 class Edges(object):
 
-    def __init__(self, src_fn, dst_fn, offset=np.array([0,0,0])):
+    def __init__(self, src_fn, dst_fn, offset=np.array([0,0,0]), cache=False,
+                                    journaled=False, undo_bytes=UNDO_BYTES):
         """Contains dictionaries for fast edge lookup & manipulation
 
+        Args:
+            cache: keep a binary sidecar of the parsed table next to src_fn
+                & memory-map it on later loads (see `edge_cache`)
+            journaled: save edits to an append-only journal next to dst_fn
+                instead of rewriting dst_fn (see `compact_journal`). If the
+                journal exists, its base table is loaded & the edits replayed.
+            undo_bytes: memory cap of the undo/redo history (see `UndoLog`)
 
         Attributes:
             src_fn: location of edges csv
             dst_fn
             syn_to_pre_seg: synapse ID returns pre ID
             syn_to_post_seg: synapse ID returns post ID
-            segs_to_syn: tuple of pre, post IDs looks up synapse ID
+            segs_to_syn: tuple of pre, post IDs looks up list of synapse IDs
             syn_coords: synapse ID returns coords of its centroid
             syn_coords_pre_post: syn ID returns 2 coords - pre/post centroids
             syn_size: synapse ID returns its size (no. of voxels)
@@ -36,22 +122,37 @@ class Edges(object):
             post_to_syns: seg ID returns list of postsynaptic synapse IDs
             post_to_pre: seg ID returns list of connected pre seg IDs
             pre_to_post: seg ID returns list of connected post seg IDs
+
+        The seg-keyed lookups & segs_to_syn are `Adjacency` objects.
         """
         self.src_fn = src_fn
         self.dst_fn = dst_fn
         self.offset = offset
+        self.cache = cache
         self.syn_to_pre_seg = {}
         self.syn_to_post_seg = {}
-        self.segs_to_syn = {}
-        self.pre_to_syns = {}
-        self.post_to_syns = {}
+        self.segs_to_syn = Adjacency()
+        self.pre_to_syns = Adjacency()
+        self.post_to_syns = Adjacency()
         self.syn_coords = {}
         self.syn_coords_pre_post = {}
         self.syn_size = {}
-        self.post_to_pre = {}
-        self.pre_to_post = {}
+        self.post_to_pre = Adjacency()
+        self.pre_to_post = Adjacency()
         self.max_syn = 99999999
-        self.edit_stack = []
+        self.history = UndoLog(undo_bytes)
+        self.journal = None
+        self.pending = []
+        if journaled:
+            self.journal = journal.EditJournal(dst_fn + '.journal')
+            if self.journal.exists():
+                header, records = self.journal.read()
+                self.src_fn = header['base']
+                self.offset = np.array(header['offset'])
+                self.load()
+                self.replay(records)
+                self.max_syn = max(self.max_syn, header.get('max_syn', 0))
+                return
         self.load()
 
     def load(self):
@@ -65,33 +166,73 @@ class Edges(object):
             [:,6] synapse psd voxel count
             [:,7:] additional columns (e.g. pre & post coords)
         """
-        e = np.genfromtxt(self.src_fn, delimiter=",", dtype=int)
-        e[:,3:6] -= self.offset
-        e[:,7:10] -= self.offset 
-        e[:,10:13] -= self.offset 
-
-        for i in range(0, e.shape[0]):
-            self.syn_to_pre_seg[e[i,0]] = e[i,1]
-            self.syn_to_post_seg[e[i,0]] = e[i,2]
-            self.syn_coords[e[i,0]] = list(e[i,3:6])
-            if e.shape[1] > 7:
-                self.syn_coords_pre_post[e[i,0]] = [e[i,7:10].tolist(), 
-                                                        e[i,10:13].tolist()]
+        c = load_edge_columns(self.src_fn, self.offset, cache=self.cache)
+        ids = c['id'].tolist()
+        pre = c['pre'].tolist()
+        post = c['post'].tolist()
+        coords = c['centroid'].tolist()
+        sizes = c['size'].tolist()
+        pre_coords = c['pre_centroid'].tolist()
+        post_coords = c['post_centroid'].tolist()
+
+        for i in range(len(ids)):
+            self.syn_to_pre_seg[ids[i]] = pre[i]
+            self.syn_to_post_seg[ids[i]] = post[i]
+            self.syn_coords[ids[i]] = coords[i]
+            self.syn_coords_pre_post[ids[i]] = [pre_coords[i], post_coords[i]]
+            self.syn_size[ids[i]] = sizes[i]
+            self.segs_to_syn.add((pre[i], post[i]), ids[i])
+            self.pre_to_syns.add(pre[i], ids[i])
+            self.post_to_syns.add(post[i], ids[i])
+            self.post_to_pre.add(post[i], pre[i])
+            self.pre_to_post.add(pre[i], post[i])
+
+        self.max_syn = max(ids) if ids else 0
+
+    def replay(self, records):
+        """Apply journal records directly to the storage (no logging)
+        """
+        for r in records:
+            if r['op'] == 'add':
+                self._insert(r['syn'], r['pre'], r['post'], r['center'],
+                            r['size'], r['pre_coord'], r['post_coord'])
+                self.max_syn = max(self.max_syn, r['syn'])
             else:
-                self.syn_coords_pre_post[e[i,0]] = [syn_coords[e[i,0]], 
-                                                            syn_coords[e[i,0]]]
-            self.syn_size[e[i,0]] = e[i,6]
-            push_dict(self.segs_to_syn, tuple(e[i,1:3].tolist()), e[i,0])
-            push_dict(self.pre_to_syns, e[i,1], e[i,0])
-            push_dict(self.post_to_syns, e[i,2], e[i,0])
-            push_dict(self.post_to_pre, e[i,2], e[i,1])
-            push_dict(self.pre_to_post, e[i,1], e[i,2])
-
-        unique(self.post_to_pre)
-        unique(self.pre_to_post)
-        self.max_syn = np.max(np.array(self.syn_coords.keys()))
+                self._delete(r['syn'])
+        print('replayed ' + str(len(records)) + ' journaled edits')
 
     def save(self):
+        """Save edits: append them to the journal if journaled, otherwise
+        rewrite the whole edges csv file
+        """
+        if self.journal is None:
+            self.write_table()
+            return
+        if not self.journal.exists():
+            self.journal.start(self.src_fn, self.offset, self.max_syn)
+        self.journal.append(self.pending)
+        print('journaled ' + str(len(self.pending)) + ' edits')
+        self.pending = []
+
+    def compact_journal(self):
+        """Merge journal into its base table, writing dst_fn in one pass
+
+        The journal is then restarted on top of dst_fn. max_syn is kept in
+        its header, so IDs of synapses added & removed before the compaction
+        are not handed out again.
+        """
+        if self.journal is None:
+            raise ValueError('compact_journal needs journaled Edges; '
+                                            'use save to rewrite ' + self.dst_fn)
+        self.save()
+        header, records = self.journal.read()
+        base = load_edge_columns(header['base'], np.array(header['offset']))
+        save_edge_columns(self.dst_fn, journal.merge_edits(base, records))
+        self.src_fn = self.dst_fn
+        self.offset = np.array([0,0,0])
+        self.journal.start(self.src_fn, self.offset, self.max_syn)
+
+    def write_table(self):
         """Write set of edge dicts back to edges csv file
         """
         with open(self.dst_fn, 'wb') as f:
@@ -119,25 +260,9 @@ class Edges(object):
             Updated dictionaries
         """
         print('deleting synapse no. ' + str(syn))
-        pre = self.syn_to_pre_seg[syn]
-        post = self.syn_to_post_seg[syn]
-        size = self.syn_size[syn]
-        pre_coord, post_coord = self.syn_coords_pre_post[syn]
-        del self.syn_to_pre_seg[syn]
-        del self.syn_to_post_seg[syn]
-        del self.syn_coords[syn]
-        del self.syn_size[syn]
-        del self.syn_coords_pre_post[syn]
-        self.pre_to_syns[pre].remove(syn)
-        self.post_to_syns[post].remove(syn)
-        shared_synapses = self.segs_to_syn[(pre, post)]
-        if len(shared_synapses) > 1:
-            self.segs_to_syn[(pre, post)].remove(syn)
-        else:
-            del self.segs_to_syn[(pre, post)]
-            self.post_to_pre[post].remove(pre)
-            self.pre_to_post[pre].remove(post)
-        self.edit_stack.append((0, syn, pre, post, pre_coord, post_coord, size))
+        self._log_removal([syn])
+        self._delete(syn)
+        self._journal_edits([journal.remove_record(syn)])
 
     def add_edge(self, pre, post, pre_coord, post_coord, size=0, syn=0):
         """Add edge to the edge dictionaries
@@ -155,37 +280,202 @@ class Edges(object):
         if syn == 0:
             self.max_syn += 1
             syn = self.max_syn
+        else:
+            self._check_new([syn])
+            self.max_syn = max(self.max_syn, syn)
         print('adding synapse no. ' + str(syn))
         points = np.array([pre_coord, post_coord])
         center = np.round(np.mean(points, axis=0)).astype(int).tolist()
+        self._insert(syn, pre, post, center, size, pre_coord, post_coord)
+        self._journal_edits([journal.add_record(syn, pre, post, center, size,
+                                                        pre_coord, post_coord)])
+        self.history.push(ADD, syn, pre, post, center, size, pre_coord,
+                                                                post_coord)
+
+    def remove_edges(self, syns):
+        """Remove many edges at once, as a single undo step
+
+        Duplicate IDs are removed once. If any ID is not a live synapse,
+        KeyError is raised before anything is changed.
+
+        Args:
+            syns: list or array of synapse IDs
+        """
+        syns = list(OrderedDict.fromkeys(int(s) for s in syns))
+        if not syns:
+            return
+        missing = self._missing(syns)
+        if missing:
+            raise KeyError(missing)
+        print('deleting ' + str(len(syns)) + ' synapses')
+        self._log_removal(syns)
+        self._delete_many(syns)
+        self._journal_edits(journal.remove_record(s) for s in syns)
+
+    def add_edges(self, pre, post, pre_coords, post_coords, sizes=None,
+                                                                syns=None):
+        """Add many edges at once, as a single undo step
+
+        Args:
+            pre: N presynaptic seg IDs
+            post: N postsynaptic seg IDs
+            pre_coords: Nx3 presynaptic synapse coordinates
+            post_coords: Nx3 postsynaptic synapse coordinates
+            sizes: N PSD volumes (default 0)
+            syns: N synapse IDs (default: new IDs after max_syn). Repeated
+                IDs raise ValueError & IDs of live synapses KeyError, before
+                anything is changed.
+
+        Returns:
+            list of the new synapse IDs
+        """
+        pre = np.asarray(pre, dtype=np.int64).tolist()
+        post = np.asarray(post, dtype=np.int64).tolist()
+        n = len(pre)
+        if n == 0:
+            return []
+        pre_coords = np.asarray(pre_coords).reshape(n, 3)
+        post_coords = np.asarray(post_coords).reshape(n, 3)
+        if sizes is None:
+            sizes = [0]*n
+        sizes = np.asarray(sizes, dtype=np.int64).tolist()
+        if syns is None:
+            syns = list(range(self.max_syn + 1, self.max_syn + n + 1))
+            self.max_syn += n
+        else:
+            syns = np.asarray(syns, dtype=np.int64).tolist()
+            if len(syns) != n:
+                raise ValueError('expected ' + str(n) + ' synapse IDs')
+            self._check_new(syns)
+            self.max_syn = max(self.max_syn, max(syns))
+        print('adding ' + str(n) + ' synapses')
+        centers = np.round((pre_coords + post_coords) / 2.).astype(int)
+        centers = centers.tolist()
+        pre_coords = pre_coords.tolist()
+        post_coords = post_coords.tolist()
+        self._insert_many(syns, pre, post, centers, sizes, pre_coords,
+                                                                post_coords)
+        records = list(zip(syns, pre, post, centers, sizes, pre_coords,
+                                                                post_coords))
+        self._journal_edits(journal.add_record(*r) for r in records)
+        with self.history.transaction():
+            for r in records:
+                self.history.push(ADD, *r)
+        return syns
+
+    def _log_removal(self, syns):
+        """Record synapses about to be removed in the undo history
+
+        All records are read before the undo group is opened, so an unknown
+        ID raises KeyError without leaving a partial group behind.
+        """
+        records = []
+        for syn in syns:
+            pre_coord, post_coord = self.syn_coords_pre_post[syn]
+            records.append((syn, self.syn_to_pre_seg[syn],
+                            self.syn_to_post_seg[syn], self.syn_coords[syn],
+                            self.syn_size[syn], pre_coord, post_coord))
+        with self.history.transaction():
+            for r in records:
+                self.history.push(REMOVE, *r)
+
+    def _check_new(self, syns):
+        """Raise if syns can't be added: repeated IDs or live synapses
+        """
+        if len(set(syns)) != len(syns):
+            raise ValueError('repeated synapse IDs')
+        taken = sorted(set(syns) - set(self._missing(syns)))
+        if taken:
+            raise KeyError(taken)
+
+    def _missing(self, syns):
+        """IDs of syns that are not live synapses
+        """
+        return [s for s in syns if s not in self.syn_to_pre_seg]
+
+    def transaction(self):
+        """Context manager grouping the edits made inside into one undo step
+        """
+        return self.history.transaction()
+
+    def _delete(self, syn):
+        """Drop synapse from the storage (no logging)
+        """
+        pre = self.syn_to_pre_seg[syn]
+        post = self.syn_to_post_seg[syn]
+        del self.syn_to_pre_seg[syn]
+        del self.syn_to_post_seg[syn]
+        del self.syn_coords[syn]
+        del self.syn_size[syn]
+        del self.syn_coords_pre_post[syn]
+        self.pre_to_syns.discard(pre, syn)
+        self.post_to_syns.discard(post, syn)
+        self.segs_to_syn.discard((pre, post), syn)
+        self.post_to_pre.discard(post, pre)
+        self.pre_to_post.discard(pre, post)
+
+    def _insert(self, syn, pre, post, center, size, pre_coord, post_coord):
+        """Write synapse into the storage (no logging)
+        """
         self.syn_to_pre_seg[syn] = pre
         self.syn_to_post_seg[syn] = post
         self.syn_coords[syn] = center
         self.syn_size[syn] = size
         self.syn_coords_pre_post[syn] = [pre_coord, post_coord]
-        self.segs_to_syn[(pre, post)] = syn
-        push_dict(self.pre_to_syns, pre, syn)
-        push_dict(self.post_to_syns, post, syn)
-        push_dict(self.pre_to_post, pre, post)
-        push_dict(self.post_to_pre, post, pre)
+        self.segs_to_syn.add((pre, post), syn)
+        self.pre_to_syns.add(pre, syn)
+        self.post_to_syns.add(post, syn)
+        self.pre_to_post.add(pre, post)
+        self.post_to_pre.add(post, pre)
 
-        self.pre_to_post[pre] = list(set(self.pre_to_post[pre]))
-        self.post_to_pre[post] = list(set(self.post_to_pre[post]))
+    def _delete_many(self, syns):
+        for syn in syns:
+            self._delete(syn)
 
-        self.edit_stack.append((1, syn, pre, post, pre_coord, post_coord, size))
+    def _insert_many(self, syns, pre, post, centers, sizes, pre_coords,
+                                                                post_coords):
+        for r in zip(syns, pre, post, centers, sizes, pre_coords, post_coords):
+            self._insert(*r)
 
     def undo(self):
-        if self.edit_stack:
-            last_edit = self.edit_stack.pop()
-            add_del, syn, pre, post, pre_coord, post_coord, size = last_edit
-            if add_del:
-                self.remove_edge(syn)
-                self.edit_stack.pop();
-            else:
-                self.add_edge(pre, post, pre_coord, post_coord, size, syn)
-                self.edit_stack.pop();
-        else:
+        """Revert the last edit, batch or transaction
+        """
+        records = self.history.undo()
+        if not records:
             print('No changes made.')
+            return
+        for op, syn, pre, post, center, size, pre_coord, post_coord in records:
+            self._apply(REMOVE if op == ADD else ADD, syn, pre, post, center,
+                                                size, pre_coord, post_coord)
+        print('undid ' + str(len(records)) + ' edits')
+
+    def redo(self):
+        """Reapply the last undone edit, batch or transaction
+        """
+        records = self.history.redo()
+        if not records:
+            print('Nothing to redo.')
+            return
+        for r in records:
+            self._apply(*r)
+        print('redid ' + str(len(records)) + ' edits')
+
+    def _apply(self, op, syn, pre, post, center, size, pre_coord, post_coord):
+        """Apply an edit to the storage & journal, bypassing the history
+        """
+        if op == ADD:
+            self._insert(syn, pre, post, center, size, pre_coord, post_coord)
+            self._journal_edits([journal.add_record(syn, pre, post, center,
+                                                size, pre_coord, post_coord)])
+        else:
+            self._delete(syn)
+            self._journal_edits([journal.remove_record(syn)])
+
+    def _journal_edits(self, records):
+        """Queue journal records for the next save (only if journaled)
+        """
+        if self.journal is not None:
+            self.pending.extend(records)
 
 
 def transform_coords(coords_dict, offset, s=np.array([1,1,1])):
@@ -209,16 +499,15 @@ def remap(map_dict, seg_list):
     """Remap a list of segments (can be slice of larger numpy array)
 
     Args:
-        map_dict: dict mapping old seg id to a new seg id
+        map_dict: dict mapping old seg id to a new seg id, or a RemapTable
+            (convert once with `remap.as_remap_table` when remapping
+            several arrays)
         seg_list: slice of numpy array that will be overwritten
 
     Returns:
         seg_list will be modified with new seg ids
     """
-    for x in np.nditer(seg_list, op_flags=['readwrite']):
-        # not in map, object maps to itself
-        if int(x) in map_dict: 
-            x[...] = map_dict[int(x)]
+    as_remap_table(map_dict).apply_inplace(seg_list)
 
 def find_nearest(pt, pts):
     """Find points in pts that's nearest to pt (return first closest)
@@ -234,7 +523,87 @@ def find_nearest(pt, pts):
     idx = (np.linalg.norm(pts - pt, axis=1)).argmin()
     return pts[idx], idx
 
-def remap_synapse_centroids_from_pickle(edges, pre_post_dicts):
+def nearest_index(pts, candidates):
+    """Row index of the candidate nearest to each point (first closest)
+
+    Large candidate sets are queried through a KD-tree (when scipy is
+    available); rows where the tree reports a tie are re-resolved by brute
+    force so the lowest index wins, as with `find_nearest`. Small sets are
+    compared exhaustively in blocks of at most NEAREST_BLOCK distances.
+
+    Args:
+        pts: MxN integer array of query points
+        candidates: KxN integer array of points to be searched against
+
+    Returns:
+        M-element array of row indices into candidates
+    """
+    pts = np.asarray(pts, dtype=np.int64)
+    candidates = np.asarray(candidates, dtype=np.int64)
+    if cKDTree is not None and len(candidates) >= KDTREE_MIN:
+        d, idx = cKDTree(candidates).query(pts, k=2)
+        idx = idx[:,0].copy()
+        tie = d[:,0] == d[:,1]
+        if tie.any():
+            idx[tie] = nearest_index_brute(pts[tie], candidates)
+        return idx
+    return nearest_index_brute(pts, candidates)
+
+def nearest_index_brute(pts, candidates):
+    """Exhaustive `nearest_index`, on exact integer squared distances
+    """
+    idx = np.empty(len(pts), dtype=np.int64)
+    step = max(1, NEAREST_BLOCK // max(1, len(candidates)))
+    for i in range(0, len(pts), step):
+        diff = pts[i:i+step,None,:] - candidates[None,:,:]
+        idx[i:i+step] = (diff*diff).sum(axis=2).argmin(axis=1)
+    return idx
+
+def _match_group(args):
+    rows, pts, candidates = args
+    return rows, candidates[nearest_index(pts, candidates)]
+
+def match_nearest(segs, pts, seg_map, start=0, processes=1):
+    """For each row, nearest candidate centroid of that row's segment
+
+    Rows are grouped by segment, so each segment's candidates are converted
+    to an array & indexed once, and all of its rows are resolved in one
+    query. Groups can be spread across a process pool.
+
+    Args:
+        segs: N segment IDs
+        pts: Nx3 query points (e.g. synapse centroids)
+        seg_map: segID to list of candidate centroids
+        start, step 2: which of the interleaved candidates to use
+            (0 for pre, 1 for post)
+        processes: size of process pool (1 runs in this process)
+
+    Returns:
+        Nx3 array of matched centroids
+    """
+    segs = np.asarray(segs)
+    pts = np.asarray(pts)
+    out = np.zeros(pts.shape, dtype=pts.dtype)
+    uniq, inv = np.unique(segs, return_inverse=True)
+    order = np.argsort(inv, kind='mergesort')
+    ptr = np.searchsorted(inv[order], np.arange(len(uniq) + 1))
+    jobs = []
+    for j, seg in enumerate(uniq.tolist()):
+        rows = order[ptr[j]:ptr[j+1]]
+        candidates = np.array(seg_map[seg])[start::2]
+        jobs.append((rows, pts[rows], candidates))
+    if processes > 1:
+        pool = Pool(processes)
+        results = pool.map(_match_group, jobs, chunksize=64)
+        pool.close()
+        pool.join()
+    else:
+        results = map(_match_group, jobs)
+    for rows, matched in results:
+        out[rows] = matched
+    return out
+
+def remap_synapse_centroids_from_pickle(edges, pre_post_dicts, processes=1):
     """Associate pre & post segment centroids from synapse centroid.
 
     Ignacio T associated each synapse centroid with a pre and post centroid &
@@ -244,6 +613,7 @@ def remap_synapse_centroids_from_pickle(edges, pre_post_dicts):
     Args:
         edges: Nx7 numpy array of edges (see `load_edges`)
         pre_post_dicts: list of two dicts - segID to centroid - for pre & post
+        processes: size of process pool for matching (see `match_nearest`)
     
     Returns:
         new edge list with additional columns for the two additional centroids
@@ -253,32 +623,195 @@ def remap_synapse_centroids_from_pickle(edges, pre_post_dicts):
     new_edges[:,:-6] = edges
     premap = pre_post_dicts[0]
     postmap = pre_post_dicts[1]
-    for row in new_edges:
-        pre = row[1]
-        post = row[2]
-        centr = row[3:6]
-        possible_pre = np.array(premap[pre])[::2]
-        possible_post = np.array(postmap[post])[1::2]
-        row[7:10], _ = find_nearest(centr, possible_pre)
-        row[10:13], _ = find_nearest(centr, possible_post)
+    centr = new_edges[:,3:6]
+    new_edges[:,7:10] = match_nearest(new_edges[:,1], centr, premap, 0, 
+                                                                    processes)
+    new_edges[:,10:13] = match_nearest(new_edges[:,2], centr, postmap, 1,
+                                                                    processes)
     return new_edges
 
+def count_lines(fn, chunk_bytes=CHUNK_BYTES):
+    """Count lines of a text file in binary blocks, without parsing it
+    """
+    n = 0
+    last = b'\n'
+    with open(fn, 'rb') as f:
+        block = f.read(chunk_bytes)
+        while block:
+            n += block.count(b'\n')
+            last = block[-1:]
+            block = f.read(chunk_bytes)
+    if last != b'\n':
+        n += 1
+    return n
+
+def iter_table_chunks(fn, delimiter=',', dtype=np.int64,
+                                                chunk_bytes=CHUNK_BYTES):
+    """Parse a delimited integer table in blocks of ~chunk_bytes
+
+    Each block is cut at its last newline & handed to np.loadtxt in one call.
+    Blank & whitespace-only lines are skipped, as np.genfromtxt did.
+
+    Args:
+        fn: path to table (no header)
+        delimiter: column separator
+        dtype: dtype of the parsed values
+        chunk_bytes: size of each read
+
+    Yields:
+        2D numpy arrays of consecutive rows
+    """
+    ncols = None
+    with open(fn, 'rb') as f:
+        tail = b''
+        while True:
+            block = f.read(chunk_bytes)
+            eof = not block
+            block = tail + block
+            if eof:
+                tail = b''
+            else:
+                cut = block.rfind(b'\n') + 1
+                block, tail = block[:cut], block[cut:]
+            if block.strip():
+                block = BLANK_LINES.sub(b'', block)
+                chunk = np.loadtxt(BytesIO(block), delimiter=delimiter,
+                                                        dtype=dtype, ndmin=2)
+                if ncols is None:
+                    ncols = chunk.shape[1]
+                if chunk.shape[1] != ncols:
+                    raise ValueError('could not parse ' + fn + 
+                                        ' as ' + str(ncols) + ' int columns')
+                if len(chunk):
+                    yield chunk
+            if eof:
+                break
+
+def load_table(fn, delimiter=',', dtype=np.int64, chunk_bytes=CHUNK_BYTES,
+                                                                    ncols=0):
+    """Load a delimited integer table into one preallocated array
+
+    Replaces np.genfromtxt for large tables: peak memory is the output array
+    plus one chunk. An empty file gives a (0, ncols) array.
+    """
+    t = time.time()
+    n = count_lines(fn, chunk_bytes)
+    table = None
+    i = 0
+    for chunk in iter_table_chunks(fn, delimiter, dtype, chunk_bytes):
+        if table is None:
+            table = np.empty((n, chunk.shape[1]), dtype=dtype)
+        table[i:i+len(chunk)] = chunk
+        i += len(chunk)
+    if table is None:
+        table = np.empty((0, ncols), dtype=dtype)
+    report_rate(fn, i, time.time() - t)
+    return table[:i]
+
+def load_edge_columns(fn, offset=np.array([0,0,0]), chunk_bytes=CHUNK_BYTES,
+                                                                cache=False):
+    """Load edges csv into typed columns (see `Edges.load` for format)
+
+    Chunks are streamed into preallocated arrays: int64 IDs & sizes, int32
+    coordinates. The offset is subtracted from each chunk's coordinates as
+    it is copied in. Tables with only 7 columns reuse the synapse centroid
+    as the pre & post centroids.
+
+    With cache set, the columns are kept in a binary sidecar next to fn &
+    returned memory-mapped read-only (see `edge_cache.load_cached`).
+
+    Returns:
+        dict of column arrays: id, pre, post, centroid, size, pre_centroid,
+        post_centroid
+    """
+    if cache:
+        return edge_cache.load_cached(fn, 'columns', 
+                            lambda: load_edge_columns(fn, offset, chunk_bytes),
+                            extra=np.asarray(offset).tolist())
+    t = time.time()
+    n = count_lines(fn, chunk_bytes)
+    c = {'id': np.empty(n, dtype=np.int64),
+         'pre': np.empty(n, dtype=np.int64),
+         'post': np.empty(n, dtype=np.int64),
+         'centroid': np.empty((n,3), dtype=np.int32),
+         'size': np.empty(n, dtype=np.int64),
+         'pre_centroid': np.empty((n,3), dtype=np.int32),
+         'post_centroid': np.empty((n,3), dtype=np.int32)}
+    i = 0
+    for e in iter_table_chunks(fn, ',', np.int64, chunk_bytes):
+        j = i + len(e)
+        c['id'][i:j] = e[:,0]
+        c['pre'][i:j] = e[:,1]
+        c['post'][i:j] = e[:,2]
+        c['centroid'][i:j] = e[:,3:6] - offset
+        c['size'][i:j] = e[:,6]
+        if e.shape[1] > 7:
+            c['pre_centroid'][i:j] = e[:,7:10] - offset
+            c['post_centroid'][i:j] = e[:,10:13] - offset
+        else:
+            c['pre_centroid'][i:j] = c['centroid'][i:j]
+            c['post_centroid'][i:j] = c['centroid'][i:j]
+        i = j
+    report_rate(fn, i, time.time() - t)
+    return dict((k, v[:i]) for k, v in c.items())
+
+def report_rate(fn, n, dt):
+    print('loaded ' + str(n) + ' rows from ' + fn + ' in ' + 
+                '%.2f s (%d rows/s)' % (dt, n / max(dt, 1e-9)))
+
+def load_edges(fn, offset=np.array([0,0,0]), chunk_bytes=CHUNK_BYTES,
+                                                                cache=False):
+    """Load edges csv as an NxM int64 array, coordinates shifted by offset
+
+    With cache set, the array is memory-mapped read-only from a sidecar.
+    """
+    if cache:
+        build = lambda: {'table': load_edges(fn, offset, chunk_bytes)}
+        return edge_cache.load_cached(fn, 'table', build, 
+                                    extra=np.asarray(offset).tolist())['table']
+    e = load_table(fn, ',', np.int64, chunk_bytes, ncols=13)
+    e[:,3:6] -= offset
+    if e.shape[1] > 7:
+        e[:,7:10] -= offset
+        e[:,10:13] -= offset
+    return e
+
+def save_edges(fn, e):
+    """Write NxM edges array to csv (see `load_edges`)
+    """
+    np.savetxt(fn, e, delimiter=',', fmt='%d')
+
+def save_edge_columns(fn, c):
+    """Write edge columns to csv (see `load_edge_columns`)
+    """
+    e = np.column_stack((c['id'], c['pre'], c['post'], c['centroid'],
+                        c['size'], c['pre_centroid'], c['post_centroid']))
+    save_edges(fn, e)
+
 def load_map_dict(fn):
     """Load a Python pickled dict mapping old IDs to new IDs
+
+    For large maps, prefer a binary remap table (see `remap.load_remap`).
     """
     return pickle.load(open(fn, "rb"))
 
 def remap_edge_list(map_fn, edge_fn, new_fn):
-    map_dict = load_map_dict(map_fn)
+    """Remap pre & post seg IDs of edges csv
+
+    Args:
+        map_fn: .npy remap table (see `remap.save_remap_table`) or pickle
+    """
+    table = load_remap(map_fn)
     edges = load_edges(edge_fn)
-    remap(map_dict, edges[:,1])
-    remap(map_dict, edges[:,2])
+    table.apply_inplace(edges[:,1:3])
     save_edges(new_fn, edges)
 
 def remap_seg_list(map_fn, seg_fn, new_fn):
-    map_dict = load_map_dict(map_fn)
-    segs = np.genfromtxt(seg_fn, delimiter=";", dtype=int)
-    remap(map_dict, segs[:,0])
+    """Remap seg IDs in first column of ;-delimited list (see remap_edge_list)
+    """
+    table = load_remap(map_fn)
+    segs = load_table(seg_fn, delimiter=";")
+    table.apply_inplace(segs[:,0])
     np.savetxt(new_fn, segs, delimiter=';', fmt='%d')
 
 def load_labels(fn, delimiter=',', id_col=0, label_col=1):
@@ -286,7 +819,7 @@ def load_labels(fn, delimiter=',', id_col=0, label_col=1):
     Load ID list with label IDs
     e.g. use to load segment label, or synapse label
     """
-    d = np.genfromtxt(fn, delimiter=delimiter, dtype=int)
+    d = load_table(fn, delimiter=delimiter)
     label_to_id = {}
     id_to_label = {}
     for i in range(d.shape[0]):
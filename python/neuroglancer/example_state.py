@@ -1,118 +1,64 @@
-import threading
-from tornado import web, ioloop, httpserver
-from sockjs.tornado import SockJSConnection, SockJSRouter
-import json 
-from collections import OrderedDict
 import numpy as np
 import Tkinter as tk
-
-clients = set()
-n_messages = 0
-current_state = None
-
-class Connection(SockJSConnection):
-    def on_open(self, info):
-        """
-        info is an object which contains caller IP address, query string
-        parameters and cookies associated with this request"""
-        # When new client comes in, will add it to the clients list
-        clients.add(self)
-       
-    def on_message(self, json_state):
-        """
-        This will call initialize_state or on_state_change depening on if it is
-        the first message recieved.
-        """
-        global current_state
-        current_state = json.JSONDecoder(object_pairs_hook=OrderedDict).decode(json_state)
-        global n_messages
-
-        if not n_messages: #first message ever
-            new_state = self.initialize_state(current_state)
-        else:
-            new_state = self.on_state_change(current_state)
-
-        n_messages += 1
-        if new_state: #if you return a new state send it back
-            self.broadcast(clients, json.dumps(new_state))
-        
-    def on_close(self):
-        # If client disconnects, remove him from the clients list
-        clients.remove(self)
-
-    def initialize_state(self, state):
-        """
-        This is called once the connection is stablished
-        """
-        # for i in range(1,9):
-            # cluster_fn = "/usr/people/tmacrina/seungmount/research/tommy/s1/data/cluster_synapses/170301_tm_cluster_" + str(i) + "_synapses.csv"
-            # state['layers']['cluster' + str(i)] = {'type':'point', 'points':np.genfromtxt(cluster_fn).tolist()}
-        # offset = np.array([17409,16385,16385])
-        # points = np.array([26249,22475,16822])
-        # state['layers']['synapses'] = {'type':'point', 'points':[(points-offset).tolist()]}
-        # state['layers']['segmentation']['segments'] = [6648872,640967]
-        #state['navigation']['pose']['position']['voxelCoordinates'] = [(points-offset).tolist()]
-        #state['navigation']['pose']['position']['zoomFactor'] = 1.0
-        return state
-
-    def on_state_change(self, state):
-        """
-        This is called every time there is a new state available
-        (except the very first time).
-        """
-        # print(state['layers'])
-        # offset = np.array([17409,16385,16385])
-        # points = np.array([26249,22475,16822])
-        # state['navigation']['pose']['position']['voxelCoordinates'] = (points-offset).tolist()
-        # state['navigation']['pose']['position']['zoomFactor'] = 1.0
-        print("state change")
-        return state         
+from state_server import StateServer
 
 # In order for the webbrowser to connect to this server
-# add to the url 'stateURL':'http://localhost:9999'
-router = SockJSRouter(Connection)
-def broadcast(state):
+# add to the url 'stateURL':'https://localhost:9999'
+print("setting up port")
+server = StateServer(9999)
+session = server.session()
+
+def initialize_state(state):
     """
-    Use this method to broadcast a new state to all connected clients.
-    Without the need to wait for an `on_state_change`.
+    This is called once the connection is stablished
     """
-    router.broadcast(clients, json.dumps(state))
+    # for i in range(1,9):
+        # cluster_fn = "/usr/people/tmacrina/seungmount/research/tommy/s1/data/cluster_synapses/170301_tm_cluster_" + str(i) + "_synapses.csv"
+        # state['layers']['cluster' + str(i)] = {'type':'point', 'points':np.genfromtxt(cluster_fn).tolist()}
+    # offset = np.array([17409,16385,16385])
+    # points = np.array([26249,22475,16822])
+    # state['layers']['synapses'] = {'type':'point', 'points':[(points-offset).tolist()]}
+    # state['layers']['segmentation']['segments'] = [6648872,640967]
+    #state['navigation']['pose']['position']['voxelCoordinates'] = [(points-offset).tolist()]
+    #state['navigation']['pose']['position']['zoomFactor'] = 1.0
+    return state
 
-# Tornado & Tk need to run on separate threads
-class TornadoThread(threading.Thread):
-    def __init__(self):
-        # super(TornadoThread, self).__init__()
-        # self._stop = threading.Event()
-        threading.Thread.__init__(self)
-        self.daemon = True
+def on_state_change(state):
+    """
+    This is called every time there is a new state available
+    (except the very first time).
+    """
+    # print(state['layers'])
+    # offset = np.array([17409,16385,16385])
+    # points = np.array([26249,22475,16822])
+    # state['navigation']['pose']['position']['voxelCoordinates'] = (points-offset).tolist()
+    # state['navigation']['pose']['position']['zoomFactor'] = 1.0
+    print("state change")
+    return state
 
-        socketApp = web.Application(router.urls)
-        http_server = httpserver.HTTPServer(socketApp, ssl_options={
-            "certfile": "./certificate.crt",
-            "keyfile": "./privateKey.key",
-        })
-        print("setting up port")
-        http_server.bind(9999) #port
-        print("starting server")
-        http_server.start(1)
-    
-    def run(self):
-        print("IOLoop starting")
-        ioloop.IOLoop.instance().start()
+@session.add_handler
+def on_message(state, first):
+    """
+    This will call initialize_state or on_state_change depening on if it is
+    the first message recieved. If you return a new state it is sent back.
+    """
+    if first:
+        return initialize_state(state)
+    else:
+        return on_state_change(state)
 
-TornadoThread = TornadoThread()
-TornadoThread.start()
+print("starting server")
+server.start()
 
 
 def update_voxelCoordinates(change_vector):
     """
     Adjust the voxelCoordinates by change_vector
     """
-    global current_state
-    vc = current_state['navigation']['pose']['position']['voxelCoordinates']
-    new_vc = (np.array(vc) + change_vector).tolist()
-    current_state['navigation']['pose']['position']['voxelCoordinates'] = new_vc
-    broadcast(current_state)
+    with session.edit() as state:
+        vc = state['navigation']['pose']['position']['voxelCoordinates']
+        new_vc = (np.array(vc) + change_vector).tolist()
+        state['navigation']['pose']['position']['voxelCoordinates'] = new_vc
 
 def key(event):
     """shows key or tk code for the key"""
@@ -0,0 +1,112 @@
+import numpy as np
+import os
+import json
+
+class EditJournal(object):
+
+    def __init__(self, fn):
+        """Append-only log of synapse edits made on top of a base edge table
+
+        The journal is a JSON-lines file. The first line names the base table
+        (the offset it is loaded with & the largest synapse ID handed out);
+        every following line is one edit:
+
+            {"op": "add", "syn": .., "pre": .., "post": .., "center": [..],
+                "size": .., "pre_coord": [..], "post_coord": [..]}
+            {"op": "remove", "syn": ..}
+
+        Attributes:
+            fn: location of journal file
+        """
+        self.fn = fn
+
+    def exists(self):
+        return os.path.exists(self.fn)
+
+    def start(self, base_fn, offset, max_syn=None):
+        """Create (or truncate) the journal, pointing it at a base table
+
+        max_syn, if given, is the largest synapse ID handed out so far.
+        """
+        header = {'base': base_fn, 'offset': [int(o) for o in offset]}
+        if max_syn is not None:
+            header['max_syn'] = int(max_syn)
+        with open(self.fn, 'w') as f:
+            f.write(json.dumps(header) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def append(self, records):
+        """Append edit records & fsync, so a save costs O(edits)
+        """
+        if not records:
+            return
+        with open(self.fn, 'a') as f:
+            for r in records:
+                f.write(json.dumps(r) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def read(self):
+        """Return header & list of edit records
+
+        A truncated last line (e.g. from a crash mid-write) is dropped.
+        """
+        with open(self.fn, 'r') as f:
+            lines = f.read().splitlines()
+        header = json.loads(lines[0])
+        records = []
+        for line in lines[1:]:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                print('skipping corrupt journal line: ' + line)
+        return header, records
+
+def add_record(syn, pre, post, center, size, pre_coord, post_coord):
+    """Journal record of an added synapse, with plain Python types
+    """
+    return {'op': 'add', 'syn': int(syn), 'pre': int(pre), 'post': int(post),
+            'center': [int(c) for c in center], 'size': int(size),
+            'pre_coord': [int(c) for c in pre_coord],
+            'post_coord': [int(c) for c in post_coord]}
+
+def remove_record(syn):
+    return {'op': 'remove', 'syn': int(syn)}
+
+def merge_edits(columns, records):
+    """Apply journal records to edge columns in one vectorized pass
+
+    The records are first reduced to their net effect (a set of removed IDs &
+    the final rows of added synapses), so the table itself is only filtered &
+    appended to once.
+
+    Args:
+        columns: dict of edge columns (see `edges.load_edge_columns`)
+        records: list of journal records
+
+    Returns:
+        dict of merged edge columns
+    """
+    removed = set()
+    added = {}
+    for r in records:
+        if r['op'] == 'add':
+            added[r['syn']] = r
+        else:
+            added.pop(r['syn'], None)
+            removed.add(r['syn'])
+    drop = np.array(list(removed | set(added.keys())), dtype=np.int64)
+    keep = ~np.isin(columns['id'], drop)
+    out = dict((k, v[keep]) for k, v in columns.items())
+    rows = list(added.values())
+    if rows:
+        for k, j in [('id', 'syn'), ('pre', 'pre'), ('post', 'post'),
+                                                        ('size', 'size')]:
+            new = np.array([r[j] for r in rows], dtype=out[k].dtype)
+            out[k] = np.concatenate((out[k], new))
+        for k, j in [('centroid', 'center'), ('pre_centroid', 'pre_coord'),
+                                            ('post_centroid', 'post_coord')]:
+            new = np.array([r[j] for r in rows], dtype=out[k].dtype)
+            out[k] = np.concatenate((out[k], new.reshape(-1, 3)))
+    return out
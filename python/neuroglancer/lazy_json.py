@@ -0,0 +1,220 @@
+import numpy as np
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+import codec
+
+# bytes.translate table marking structural characters with 1
+STRUCTURAL = bytes(bytearray(1 if chr(i) in '{}[],:' else 0
+                             for i in range(256)))
+OPEN_OBJECT = ord('{')
+COMMA = ord(',')
+COLON = ord(':')
+QUOTE = ord('"')
+BACKSLASH = ord('\\')
+SCALARS = (str, int, float, bool, type(None))
+
+class Scan(object):
+
+    def __init__(self, data):
+        """Positions & nesting depth of the structural characters of a JSON
+        document ({ } [ ] , : outside of strings), found with numpy
+
+        Attributes:
+            data: UTF-8 bytes of the document
+            pos: byte offsets of structural characters
+            codes: the characters, as uint8
+            depth: nesting depth after each character
+        """
+        self.data = data
+        b = np.frombuffer(data, dtype=np.uint8)
+        quotes = np.flatnonzero(b == QUOTE)
+        escaped = quotes[(quotes > 0) & (b[np.maximum(quotes - 1, 0)] == BACKSLASH)]
+        if len(escaped):
+            drop = []
+            for q in escaped.tolist():
+                k = q - 1
+                while b[k] == BACKSLASH:
+                    k -= 1
+                if (q - 1 - k) % 2:
+                    drop.append(q)
+            quotes = np.setdiff1d(quotes, drop)
+        pos = np.flatnonzero(np.frombuffer(data.translate(STRUCTURAL),
+                                           dtype=bool))
+        self.pos = pos[np.searchsorted(quotes, pos) % 2 == 0]
+        self.codes = b[self.pos]
+        step = np.zeros(len(self.pos), dtype=np.int32)
+        step[(self.codes == OPEN_OBJECT) | (self.codes == ord('['))] = 1
+        step[(self.codes == ord('}')) | (self.codes == ord(']'))] = -1
+        self.depth = np.cumsum(step)
+
+    def members(self, i):
+        """Members of the object opened by structural character i
+
+        Returns:
+            list of (key, start, end, j): byte span of each member's value,
+            j the structural index of its '{' if the value is an object,
+            else -1
+        """
+        d = self.depth[i]
+        closing = self.depth[i+1:] == d - 1
+        if not closing.any():
+            raise ValueError('unterminated JSON object')
+        j = i + 1 + int(np.argmax(closing))
+        k = np.arange(i + 1, j)
+        k = k[(self.depth[i+1:j] == d) &
+              ((self.codes[i+1:j] == COMMA) | (self.codes[i+1:j] == COLON))]
+        bounds = np.concatenate(([i], k, [j])).tolist()
+        pos = self.pos
+        out = []
+        for a, c, e in zip(bounds[0::2], bounds[1::2], bounds[2::2]):
+            key = codec.loads(self.data[pos[a]+1:pos[c]].decode('utf-8'))
+            start = int(pos[c]) + 1
+            end = int(pos[e])
+            obj = -1
+            if self.codes[c+1] == OPEN_OBJECT and \
+                    not self.data[start:pos[c+1]].strip():
+                obj = c + 1
+            out.append((key, start, end, obj))
+        return out
+
+class LazyDict(MutableMapping):
+
+    def __init__(self, scan, i):
+        """JSON object whose members are decoded on first access
+
+        Members that are objects become LazyDicts in turn, so reading
+        state['layers']['synapses']['type'] decodes neither the other layers
+        nor the points. Members never accessed keep their raw JSON, which
+        `dumps` copies instead of re-encoding. Accessed lists & objects may
+        be edited in place, so they are re-encoded.
+
+        Args:
+            scan: Scan of the document
+            i: structural index of the object's '{'
+        """
+        self._scan = scan
+        self._order = []
+        self._raw = {}
+        self._values = {}
+        for key, start, end, obj in scan.members(i):
+            if key not in self._raw:
+                self._order.append(key)
+            self._raw[key] = (start, end, obj)
+
+    def __getitem__(self, k):
+        if k in self._values:
+            return self._values[k]
+        start, end, obj = self._raw[k]
+        if obj >= 0:
+            v = LazyDict(self._scan, obj)
+        else:
+            v = codec.loads(self._scan.data[start:end].decode('utf-8'))
+        if not isinstance(v, SCALARS):
+            del self._raw[k]
+        self._values[k] = v
+        return v
+
+    def __setitem__(self, k, v):
+        if k not in self:
+            self._order.append(k)
+        self._raw.pop(k, None)
+        self._values[k] = v
+
+    def __delitem__(self, k):
+        if k not in self:
+            raise KeyError(k)
+        self._raw.pop(k, None)
+        self._values.pop(k, None)
+        self._order.remove(k)
+
+    def __contains__(self, k):
+        return k in self._raw or k in self._values
+
+    def __iter__(self):
+        return iter(list(self._order))
+
+    def __len__(self):
+        return len(self._order)
+
+    def __repr__(self):
+        return 'LazyDict(' + repr(self._order) + ')'
+
+    def raw_json(self, k):
+        """Raw JSON bytes of member k, or None if it has been accessed
+        """
+        if k not in self._raw:
+            return None
+        start, end, _ = self._raw[k]
+        return self._scan.data[start:end]
+
+    def same_raw(self, other, k):
+        """Member k is untouched in both & has the same JSON
+        """
+        if not isinstance(other, LazyDict) or k not in self._raw or \
+                k not in other._raw:
+            return False
+        if self._scan is other._scan and self._raw[k] == other._raw[k]:
+            return True
+        return self.raw_json(k) == other.raw_json(k)
+
+    def copy(self, f=None):
+        """Copy sharing the raw JSON; f, if given, is applied to the
+        accessed members (e.g. `state_sync.snapshot`)
+        """
+        new = LazyDict.__new__(LazyDict)
+        new._scan = self._scan
+        new._order = list(self._order)
+        new._raw = dict(self._raw)
+        if f is None:
+            new._values = dict(self._values)
+        else:
+            new._values = dict((k, f(v)) for k, v in self._values.items())
+        return new
+
+    def dumps(self):
+        parts = []
+        for k in self._order:
+            if k in self._raw:
+                start, end, _ = self._raw[k]
+                v = self._scan.data[start:end].decode('utf-8')
+            else:
+                v = dumps(self._values[k])
+            parts.append(codec.dumps(k) + ':' + v)
+        return '{' + ','.join(parts) + '}'
+
+def loads(message):
+    """Decode a JSON message lazily: a LazyDict if it is an object
+    """
+    data = message.encode('utf-8') if not isinstance(message, bytes) \
+                                                            else message
+    scan = Scan(data)
+    if len(scan.codes) and scan.codes[0] == OPEN_OBJECT and \
+            not data[:scan.pos[0]].strip():
+        return LazyDict(scan, 0)
+    return codec.loads(data.decode('utf-8'))
+
+def dumps(obj):
+    """Encode obj, copying the raw JSON of untouched LazyDict members
+
+    LazyDicts are found anywhere: the codec encodes what it can & dicts or
+    lists it can't (because they hold a LazyDict) are encoded member by
+    member.
+    """
+    if isinstance(obj, LazyDict):
+        return obj.dumps()
+    if isinstance(obj, dict) and 'patch' in obj and len(obj) == 1:
+        return '{"patch":[' + ','.join('{' + ','.join(
+            codec.dumps(k) + ':' + dumps(v) for k, v in op.items()) + '}'
+            for op in obj['patch']) + ']}'
+    try:
+        return codec.dumps(obj)
+    except TypeError:
+        # a LazyDict nested in plain containers: encode around it
+        if isinstance(obj, dict):
+            return '{' + ','.join(codec.dumps(k) + ':' + dumps(v)
+                                  for k, v in obj.items()) + '}'
+        if isinstance(obj, (list, tuple)):
+            return '[' + ','.join(dumps(v) for v in obj) + ']'
+        raise
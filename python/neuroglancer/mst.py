@@ -1,32 +1,159 @@
 # Functions for handling the MST
- import h5py
+import h5py
+import pickle
+import numpy as np
+from remap import load_remap, RemapTable
+
+try:
+	from collections.abc import Mapping
+except ImportError:
+	from collections import Mapping
+
+BLOCK = 1 << 24
+NO_MERGE = np.iinfo(np.int64).max
 
 def load_mst_dict(fn):
 	"""Open H5 file with "dend" dset & create child-parent dict
+
+	For MSTs that don't fit in memory, see `load_mst_table`
 	"""
 	f = h5py.File(fn, "r")
 	return create_child_to_parent_dict(f["dend"])
 
 def load_map_dict(fn):
 	"""Load a Python pickled dict mapping old IDs to new IDs
+
+	For large maps, convert to a binary remap table once & use load_map_table
+	"""
+	return pickle.load(open(fn, "rb"))
+
+def load_map_table(fn):
+	"""Load old->new ID map as a RemapTable (see `remap.load_remap`)
+	"""
+	return load_remap(fn)
+
+def read_dend(dend, block=BLOCK):
+	"""Read 2xN "dend" dataset into a numpy array, in contiguous blocks
+
+	Each block of columns is copied straight into the output with
+	read_direct, so reading is one h5py call per block, not per edge.
 	"""
-    return pickle.load(open(fn, "rb"))
+	n = dend.shape[1]
+	out = np.empty((2, n), dtype=dend.dtype)
+	for i in range(0, n, block):
+		sel = np.s_[:, i:min(i+block, n)]
+		dend.read_direct(out, sel, sel)
+	return out
+
+class ChildParentMap(Mapping):
+
+	def __init__(self, children, parents):
+		"""Child ID -> parent ID over sorted numpy arrays
+
+		A child listed more than once keeps its last parent, as when the
+		columns are written into a dict in order. Behaves as a read-only
+		dict; use `lookup` for arrays of IDs.
+
+		Attributes:
+			children: sorted unique child IDs
+			parents: parent of each child
+		"""
+		children = np.asarray(children)
+		parents = np.asarray(parents)
+		order = np.argsort(children, kind='mergesort')
+		c = children[order]
+		last = np.append(c[1:] != c[:-1], True)
+		self.children = c[last]
+		self.parents = parents[order][last]
+
+	def index(self, ids):
+		"""Positions of ids in children, and mask of the ids found
+		"""
+		ids = np.asarray(ids)
+		i = np.searchsorted(self.children, ids)
+		i[i == len(self.children)] = 0
+		found = self.children[i] == ids if len(self.children) else \
+											np.zeros(ids.shape, dtype=bool)
+		return i, found
+
+	def lookup(self, ids, default=0):
+		"""Parents of an array of IDs (default where an ID has no parent)
+		"""
+		i, found = self.index(ids)
+		out = np.full(np.shape(ids), default, dtype=self.parents.dtype)
+		out[found] = self.parents[i[found]]
+		return out
+
+	def __getitem__(self, k):
+		i, found = self.index(np.array([k]))
+		if not found[0]:
+			raise KeyError(k)
+		return self.parents[i[0]]
 
-def create_child_to_parent_dict(dend):
-	"""Create dict of child ID to list of parent IDs
+	def __iter__(self):
+		return iter(self.children.tolist())
+
+	def __len__(self):
+		return len(self.children)
+
+	def to_dict(self):
+		return dict(zip(self.children.tolist(), self.parents.tolist()))
+
+def create_child_to_parent_dict(dend, block=BLOCK):
+	"""Create map of child ID to parent ID
 
 	Our MSTs are one-to-many for x->y, x,y = dend[:,i]
+
+	Returns:
+		ChildParentMap (dict-like; see `ChildParentMap.to_dict`)
+	"""
+	d = read_dend(dend, block)
+	return ChildParentMap(d[0], d[1])
+
+def find_roots(children, parents):
+	"""Resolve every node of a forest to its root by pointer jumping
+
+	Nodes are numbered by their position in the sorted node array & each
+	points at its parent's position (roots at themselves). Every pass
+	replaces each pointer by its pointer's pointer, halving the remaining
+	path, so all nodes reach their roots in O(log depth) vectorized passes.
+
+	Args:
+		children: array of child IDs
+		parents: array of parent IDs, aligned with children
+
+	Returns:
+		nodes: sorted array of all node IDs
+		roots: root ID of each node
+	"""
+	children = np.asarray(children)
+	parents = np.asarray(parents)
+	nodes = np.union1d(children, parents)
+	parent = np.arange(len(nodes))
+	parent[np.searchsorted(nodes, children)] = np.searchsorted(nodes, parents)
+	ptr = parent
+	for _ in range(64):
+		nxt = ptr[ptr]
+		if (nxt == ptr).all():
+			break
+		ptr = nxt
+	if (ptr[ptr] != ptr).any() or (parent[ptr] != ptr).any():
+		raise ValueError('MST contains a cycle')
+	return nodes, nodes[ptr]
+
+def create_node_to_root_table(cpd):
+	"""Create RemapTable of node ID to root ID in MST
+
+	Roots map to themselves, so the table can be passed straight to
+	`edges.remap` to relabel segments by their MST root.
+
+	Args:
+		cpd: child-parent map (see create_child_to_parent_dict) or dict
 	"""
-	# cpd = {}
-	# for i in range(dend.shape[1]):
-	# 	child, parent = dend[:,i]
-	# 	cpd[child] = parent	
-	# return cpd
-	cpd = {}
-	for i in range(dend.shape[1]):
-		child, parent = dend[:,i]
-		cpd[child] = parent
-	return cpd	
+	if not isinstance(cpd, ChildParentMap):
+		cpd = ChildParentMap(list(cpd.keys()), list(cpd.values()))
+	nodes, roots = find_roots(cpd.children, cpd.parents)
+	return RemapTable(nodes, roots, presorted=True)
 
 def create_node_to_root_dict(cpd):
 	"""Create dict of node ID to root ID in MST
@@ -35,19 +162,249 @@ def create_node_to_root_dict(cpd):
 		cpd: child-parent dict (see create_child_to_parent_dict)
 
 	Outputs:
-		node-root dict
-	"""
-	nrd = {}
-	children = []
-	for k, v in cpd.iteritems():
-		if v in cpd:
-			children.append(k)
-		else:
-			root = v
-			for child in children:
-				nrd[child] = root
-			children = []
-	return nrd
+		node-root dict, for all non-root nodes
+	"""
+	table = create_node_to_root_table(cpd)
+	child = table.keys != table.values
+	return dict(zip(table.keys[child].tolist(), table.values[child].tolist()))
+
+def iter_dend(dend, block=BLOCK):
+	"""Yield (children, parents) arrays of consecutive blocks of "dend"
+	"""
+	n = dend.shape[1]
+	buf = np.empty((2, min(block, n)), dtype=dend.dtype)
+	for i in range(0, n, block):
+		j = min(i+block, n)
+		dend.read_direct(buf, np.s_[:, i:j], np.s_[:, :j-i])
+		yield buf[0, :j-i], buf[1, :j-i]
+
+def create_node_to_root_file(dend, fn, block=BLOCK):
+	"""Resolve MST roots out-of-core into an on-disk node->root table
+
+	The table is a .npy array indexed by node ID (so its size follows the
+	largest ID; our segment IDs are dense). It is filled from the dend
+	dataset one block at a time, then resolved by pointer jumping one
+	block of the memory-mapped table at a time (see `find_roots`), so
+	neither the MST nor the table need to fit in memory.
+
+	Args:
+		dend: 2xN "dend" dataset
+		fn: path of .npy table to write
+		block: columns/entries processed per step
+
+	Returns:
+		NodeRootTable opened on fn
+	"""
+	max_id = 0
+	for children, parents in iter_dend(dend, block):
+		if len(children):
+			max_id = max(max_id, int(children.max()), int(parents.max()))
+	dtype = np.uint32 if max_id < 2**32 else np.uint64
+	table = np.lib.format.open_memmap(fn, mode='w+', dtype=dtype,
+															shape=(max_id+1,))
+	for i in range(0, len(table), block):
+		table[i:i+block] = np.arange(i, min(i+block, len(table)), dtype=dtype)
+	for children, parents in iter_dend(dend, block):
+		table[children] = parents
+	for _ in range(64):
+		changed = False
+		for i in range(0, len(table), block):
+			ptr = table[i:i+block]
+			nxt = table[ptr]
+			if (nxt != ptr).any():
+				table[i:i+block] = nxt
+				changed = True
+		if not changed:
+			break
+	else:
+		raise ValueError('MST contains a cycle')
+	table.flush()
+	del table
+	return NodeRootTable(fn)
+
+def load_mst_table(fn, table_fn, block=BLOCK):
+	"""Open H5 file with "dend" dset & write its node->root table to table_fn
+	"""
+	f = h5py.File(fn, "r")
+	return create_node_to_root_file(f["dend"], table_fn, block)
+
+class NodeRootTable(object):
+
+	def __init__(self, fn):
+		"""Memory-mapped node->root table (see `create_node_to_root_file`)
+
+		Can be passed to `edges.remap` in place of a map dict. IDs beyond
+		the table map to themselves.
+		"""
+		self.fn = fn
+		self.table = np.load(fn, mmap_mode='r')
+
+	def apply(self, ids, out=None):
+		"""Roots of an array of IDs (see `remap.RemapTable.apply`)
+		"""
+		ids = np.asarray(ids)
+		if out is None:
+			out = ids.copy()
+		elif out is not ids:
+			out[...] = ids
+		inside = (ids >= 0) & (ids < len(self.table))
+		out[inside] = self.table[ids[inside]]
+		return out
+
+	def apply_inplace(self, ids):
+		return self.apply(ids, out=ids)
+
+	def lookup(self, ids, block=BLOCK):
+		"""Roots of an arbitrary batch of IDs, one block at a time
+		"""
+		ids = np.asarray(ids)
+		out = np.empty_like(ids)
+		for i in range(0, len(ids), block):
+			self.apply(ids[i:i+block], out=out[i:i+block])
+		return out
+
+def load_mst_index(fn, merge_above=True):
+	"""Open H5 file with "dend" & "dendValues" dsets & index its merges
+	"""
+	f = h5py.File(fn, "r")
+	d = read_dend(f["dend"])
+	w = f["dendValues"][:]
+	return MSTIndex(d[0], d[1], w, merge_above)
+
+class MSTIndex(object):
+
+	def __init__(self, u, v, weights, merge_above=True):
+		"""Threshold-cut queries on a weighted MST
+
+		Edges are sorted into merge order once & replayed through a
+		union-find that keeps each component's nodes as a linked list; a
+		union appends one list to the other, & the merge rank of the union
+		is recorded at the seam. The final lists lay the nodes out so every
+		component of every cut is a contiguous run of `leaf_order`, & `gaps`
+		holds the merge rank between neighbours. Cutting at threshold t
+		keeps the first K(t) merges, so:
+			component of x: extend x's position both ways while gaps < K(t),
+				in O(size)
+			all components: split `leaf_order` where gaps >= K(t), in O(n)
+		The index is a handful of int64 arrays of n, built without Python
+		objects per node.
+
+		Args:
+			u, v: arrays of MST edge endpoints (e.g. dend[0], dend[1])
+			weights: edge weights (e.g. dendValues)
+			merge_above: edges with weight >= t are merged at threshold t
+				(affinities); if False, edges with weight <= t (distances)
+		"""
+		u = np.asarray(u)
+		v = np.asarray(v)
+		weights = np.asarray(weights)
+		self.merge_above = merge_above
+		self.nodes = np.union1d(u, v)
+		n = len(self.nodes)
+		ui = np.searchsorted(self.nodes, u)
+		vi = np.searchsorted(self.nodes, v)
+		order = np.argsort(-weights if merge_above else weights,
+															kind='mergesort')
+		self.weights = weights[order]
+		ui = ui[order]
+		vi = vi[order]
+		del order
+
+		uf = np.arange(n, dtype=np.int64)
+		head = np.arange(n, dtype=np.int64)
+		tail = np.arange(n, dtype=np.int64)
+		nxt = np.full(n, -1, dtype=np.int64)
+		gap = np.full(n, NO_MERGE, dtype=np.int64)
+		for k in range(len(ui)):
+			a = _find(uf, ui[k])
+			b = _find(uf, vi[k])
+			if a == b:
+				continue
+			nxt[tail[a]] = head[b]
+			gap[tail[a]] = k
+			tail[a] = tail[b]
+			uf[b] = a
+		roots = np.flatnonzero(uf == np.arange(n))
+		nxt[tail[roots[:-1]]] = head[roots[1:]]
+		del uf, head, tail
+
+		# rank the linked list by pointer jumping: after = nodes behind x
+		after = (nxt >= 0).astype(np.int64)
+		while True:
+			i = np.flatnonzero(nxt >= 0)
+			if not len(i):
+				break
+			after[i] += after[nxt[i]]
+			nxt[i] = nxt[nxt[i]]
+		del nxt
+		self.pos = n - 1 - after
+		del after
+		self.leaf_order = np.empty(n, dtype=np.int64)
+		self.leaf_order[self.pos] = np.arange(n)
+		self.gaps = gap[self.leaf_order]
+
+	def n_merges(self, t):
+		"""Number of merges kept when cutting at threshold t
+		"""
+		if self.merge_above:
+			return int(np.searchsorted(-self.weights, -t, side='right'))
+		return int(np.searchsorted(self.weights, t, side='right'))
+
+	def component(self, seg_id, t):
+		"""IDs of all segments agglomerated with seg_id at threshold t
+		"""
+		i = np.searchsorted(self.nodes, seg_id)
+		if i == len(self.nodes) or self.nodes[i] != seg_id:
+			return np.array([seg_id])
+		k = self.n_merges(t)
+		p = int(self.pos[i])
+		# windows double, so the scans cost O(size of the component)
+		hi = p
+		w = 64
+		while True:
+			cut = np.flatnonzero(self.gaps[hi:hi+w] >= k)
+			if len(cut):
+				hi += int(cut[0])
+				break
+			hi += w
+			w *= 2
+		lo = p
+		w = 64
+		while lo > 0:
+			start = max(0, lo - w)
+			cut = np.flatnonzero(self.gaps[start:lo] >= k)
+			if len(cut):
+				lo = start + int(cut[-1]) + 1
+				break
+			lo = start
+			w *= 2
+		return self.nodes[self.leaf_order[lo:hi+1]]
+
+	def components(self, t):
+		"""Agglomeration of all segments at threshold t
+
+		Returns:
+			nodes: sorted array of segment IDs
+			roots: ID of the representative (first leaf) of each node's
+				component, e.g. for `remap.RemapTable(nodes, roots)`
+		"""
+		k = self.n_merges(t)
+		n = len(self.nodes)
+		if n == 0:
+			return self.nodes, self.nodes
+		starts = np.concatenate(([0], np.flatnonzero(self.gaps[:-1] >= k) + 1))
+		lengths = np.diff(np.append(starts, n))
+		labels = np.empty(n, dtype=np.int64)
+		labels[self.leaf_order] = np.repeat(self.leaf_order[starts], lengths)
+		return self.nodes, self.nodes[labels]
+
+def _find(uf, x):
+	"""Union-find root of x, with path halving
+	"""
+	while uf[x] != x:
+		uf[x] = uf[uf[x]]
+		x = uf[x]
+	return x
 
 # def create_omni_to_neuroglancer_dict(omni, ng):
 # 	"""Create dict of Omni ID to Neuroglancer ID
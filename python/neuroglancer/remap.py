@@ -0,0 +1,164 @@
+import numpy as np
+import sys
+import pickle
+
+CHUNK_ROWS = 1 << 22
+
+class RemapTable(object):
+
+    def __init__(self, keys, values, presorted=False, dense=True):
+        """Old ID -> new ID lookup over sorted numpy arrays
+
+        IDs not in the table map to themselves. Arrays are remapped whole
+        with np.searchsorted, or, when the keys are dense enough that a
+        lookup table over their range is at most twice their count, with
+        fancy indexing into that table.
+
+        Args:
+            keys: 1D array of old IDs
+            values: 1D array of new IDs, aligned with keys
+            presorted: keys are already sorted (e.g. memory-mapped table),
+                so use the arrays as they are
+            dense: allow building the dense lookup table
+        """
+        keys = np.asarray(keys)
+        values = np.asarray(values)
+        if not presorted:
+            order = np.argsort(keys, kind='mergesort')
+            keys = keys[order]
+            values = values[order]
+        self.keys = keys
+        self.values = values
+        self.lut = None
+        if len(self.keys):
+            self.lo = int(self.keys[0])
+            span = int(self.keys[-1]) - self.lo + 1
+            if dense and span <= 2*len(self.keys):
+                self.lut = np.arange(self.lo, self.lo + span,
+                                                    dtype=self.values.dtype)
+                self.lut[self.keys - self.lo] = self.values
+
+    @classmethod
+    def from_dict(cls, map_dict):
+        """Convert a dict of old ID to new ID, once
+        """
+        keys = np.fromiter(map_dict.keys(), dtype=np.int64, count=len(map_dict))
+        values = np.fromiter(map_dict.values(), dtype=np.int64,
+                                                        count=len(map_dict))
+        return cls(keys, values)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def apply(self, ids, out=None):
+        """Remap array of IDs
+
+        Args:
+            ids: numpy array of IDs (any shape)
+            out: array to write into (may be ids itself); new array if None
+
+        Returns:
+            remapped array
+        """
+        ids = np.asarray(ids)
+        if out is None:
+            out = ids.copy()
+        elif out is not ids:
+            out[...] = ids
+        if not len(self.keys):
+            return out
+        if self.lut is not None:
+            hit = (ids >= self.lo) & (ids < self.lo + len(self.lut))
+            out[hit] = self.lut[ids[hit] - self.lo]
+            return out
+        keys = self.keys
+        q = ids if ids.dtype == keys.dtype else ids.astype(keys.dtype)
+        i = np.searchsorted(keys, q)
+        i[i == len(keys)] = 0
+        hit = keys[i] == q
+        out[hit] = self.values[i[hit]]
+        return out
+
+    def apply_inplace(self, ids):
+        """Remap array (or writable slice/memmap) of IDs in place
+        """
+        return self.apply(ids, out=ids)
+
+    def apply_chunked(self, ids, chunk_rows=CHUNK_ROWS):
+        """Remap an array in place, chunk by chunk along its first axis
+
+        Use with memory-mapped arrays, so only one chunk of the table (plus
+        the lookup arrays) is resident at a time.
+        """
+        for i in range(0, len(ids), chunk_rows):
+            self.apply_inplace(ids[i:i+chunk_rows])
+        return ids
+
+    def apply_file(self, fn, columns=None, chunk_rows=CHUNK_ROWS):
+        """Remap a .npy file in place, out-of-core
+
+        Args:
+            fn: path to .npy file (1D, or 2D table)
+            columns: for 2D tables, list of columns holding IDs (default all)
+            chunk_rows: rows remapped per step
+        """
+        a = np.load(fn, mmap_mode='r+')
+        if columns is None or a.ndim == 1:
+            self.apply_chunked(a, chunk_rows)
+        else:
+            for i in range(0, len(a), chunk_rows):
+                for c in columns:
+                    self.apply_inplace(a[i:i+chunk_rows, c])
+        a.flush()
+        del a
+
+def save_remap_table(fn, table):
+    """Write RemapTable as one 2xN uint64 .npy: sorted keys, then values
+
+    Tables with negative IDs (e.g. a -1 sentinel) are written as int64
+    instead, so the keys stay sorted on disk.
+    """
+    dtype = np.uint64
+    if len(table) and (np.min(table.keys) < 0 or np.min(table.values) < 0):
+        dtype = np.int64
+    a = np.empty((2, len(table)), dtype=dtype)
+    a[0] = table.keys
+    a[1] = table.values
+    np.save(fn, a)
+
+def load_remap_table(fn, mmap_mode='r'):
+    """Open a .npy remap table (see `save_remap_table`), memory-mapped
+
+    Keys stay on disk & are binary searched in place; no dict is built.
+    """
+    a = np.load(fn, mmap_mode=mmap_mode)
+    return RemapTable(a[0], a[1], presorted=True, dense=False)
+
+def convert_pickle(pickle_fn, table_fn):
+    """Convert a pickled old->new ID dict into a .npy remap table
+    """
+    map_dict = pickle.load(open(pickle_fn, "rb"))
+    save_remap_table(table_fn, RemapTable.from_dict(map_dict))
+
+def load_remap(fn):
+    """Load an old->new ID map as a RemapTable: a .npy remap table is
+    memory-mapped, anything else is read as a pickled dict & converted
+    """
+    if fn.endswith('.npy'):
+        return load_remap_table(fn)
+    return RemapTable.from_dict(pickle.load(open(fn, "rb")))
+
+def as_remap_table(m):
+    """Return m as a RemapTable, converting dicts
+
+    Objects that already remap arrays (e.g. `mst.NodeRootTable`) are
+    returned as they are.
+    """
+    if isinstance(m, RemapTable) or hasattr(m, 'apply_inplace'):
+        return m
+    return RemapTable.from_dict(m)
+
+if __name__ == '__main__':
+    # python remap.py map.pkl map.npy
+    assert len(sys.argv) > 2
+    convert_pickle(sys.argv[1], sys.argv[2])
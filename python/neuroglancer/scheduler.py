@@ -0,0 +1,64 @@
+import time
+import threading
+from tornado import ioloop
+
+FRAME_INTERVAL = 1 / 30.
+
+class BroadcastScheduler(object):
+
+    def __init__(self, send, interval=FRAME_INTERVAL, io_loop=None):
+        """Coalesce state pushes into at most one per frame interval
+
+        `request` may be called from any thread (e.g. Tk callbacks) as often
+        as needed. It only marks a push as pending & hands it to the IOLoop
+        with add_callback; further requests before the push runs are merged
+        into it. The push itself runs on the IOLoop thread, no sooner than
+        interval after the previous one, & sends whatever the state is then.
+
+        Attributes:
+            requested: number of calls to `request`
+            merged: requests folded into an already pending push
+            pushed: pushes sent
+            dropped: pushes for which send returned False (e.g. no state yet)
+        """
+        self.send = send
+        self.interval = interval
+        self.io_loop = io_loop or ioloop.IOLoop.instance()
+        self.lock = threading.Lock()
+        self.pending = False
+        self.last_push = 0
+        self.requested = 0
+        self.merged = 0
+        self.pushed = 0
+        self.dropped = 0
+
+    def request(self):
+        """Schedule a push of the current state (thread-safe)
+        """
+        with self.lock:
+            self.requested += 1
+            if self.pending:
+                self.merged += 1
+                return
+            self.pending = True
+        self.io_loop.add_callback(self._schedule)
+
+    def _schedule(self):
+        delay = self.last_push + self.interval - time.time()
+        if delay > 0:
+            self.io_loop.call_later(delay, self._flush)
+        else:
+            self._flush()
+
+    def _flush(self):
+        with self.lock:
+            self.pending = False
+        self.last_push = time.time()
+        if self.send() is False:
+            self.dropped += 1
+        else:
+            self.pushed += 1
+
+    def stats(self):
+        return {'requested': self.requested, 'merged': self.merged,
+                'pushed': self.pushed, 'dropped': self.dropped}
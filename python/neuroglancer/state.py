@@ -1,99 +1,47 @@
 import sys
 from os.path import expanduser, join
-import threading
-from tornado import web, ioloop, httpserver
-from sockjs.tornado import SockJSConnection, SockJSRouter
-import json
-from collections import OrderedDict
 import numpy as np
+from state_server import StateServer
 
-clients = set()
-n_messages = 0
-global current_state
-current_state = None
-receiving_message = False
-
-class Connection(SockJSConnection):
-    def on_open(self, info):
-        """
-        info is an object which contains caller IP address, query string
-        parameters and cookies associated with this request"""
-        # When new client comes in, will add it to the clients list
-        clients.add(self)
-
-    def on_message(self, json_state):
-        """
-        This will call initialize_state or on_state_change depening on if it is
-        the first message recieved.
-        """
-        global receiving_message
-        receiving_message = True
-        global current_state
-        current_state = json.JSONDecoder(object_pairs_hook=OrderedDict).decode(json_state)
-        global n_messages
-
-        if not n_messages: #first message ever
-            new_state = self.initialize_state(current_state)
-        else:
-            new_state = self.on_state_change(current_state)
-
-        n_messages += 1
-        if new_state: #if you return a new state send it back
-            receiving_message = False
-            broadcast()
-
+# In order for the webbrowser to connect to this server
+# add to the url 'stateURL':'https://localhost:9999'
+server = StateServer(9999)
+session = server.session()
 
-    def on_close(self):
-        # If client disconnects, remove him from the clients list
-        clients.remove(self)
+def initialize_state(state):
+    """
+    This is called once the connection is stablished
+    """
+    print 'state initialized'
+    return state
 
-    def initialize_state(self, state):
-        """
-        This is called once the connection is stablished
-        """
-        print 'state initialized'
-        return state
+def on_state_change(state):
+    """
+    This is called every time there is a new state available
+    (except the very first time).
+    """
+    # store position
+    print 'state change'
+    return state
 
-    def on_state_change(self, state):
-        """
-        This is called every time there is a new state available
-        (except the very first time).
-        """
-        # store position
-        print 'state change'
-        return state
+@session.add_handler
+def on_message(state, first):
+    """
+    This will call initialize_state or on_state_change depening on if it is
+    the first message recieved. If you return a new state it is sent back.
+    """
+    if first:
+        return initialize_state(state)
+    else:
+        return on_state_change(state)
 
-# In order for the webbrowser to connect to this server
-# add to the url 'stateURL':'http://localhost:9999'
-router = SockJSRouter(Connection)
 def broadcast():
     """
     Use this method to broadcast a new state to all connected clients.
     Without the need to wait for an `on_state_change`.
+    Safe to call from any thread; calls are coalesced into at most one push
+    per frame (see `scheduler.BroadcastScheduler`).
     """
-    # global receiving_message
-    # if not receiving_message:
-    router.broadcast(clients.copy(), json.dumps(current_state))
-
-# Tornado & Tk need to run on separate threads
-class TornadoThread(threading.Thread):
-    def __init__(self):
-        # super(TornadoThread, self).__init__()
-        # self._stop = threading.Event()
-        threading.Thread.__init__(self)
-        self.daemon = True
-
-        socketApp = web.Application(router.urls)
-        http_server = httpserver.HTTPServer(socketApp, ssl_options={
-            "certfile": "./certificate.crt",
-            "keyfile": "./privateKey.key",
-        })
-        http_server.bind(9999) #port
-        http_server.start(1)
-
-    def run(self):
-        print("IOLoop starting")
-        ioloop.IOLoop.instance().start()
+    session.broadcast()
 
-TornadoThread = TornadoThread()
-TornadoThread.start()
+server.start()
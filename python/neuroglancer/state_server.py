@@ -0,0 +1,256 @@
+import threading
+from contextlib import contextmanager
+from tornado import web, ioloop, httpserver, websocket
+from sockjs.tornado import SockJSConnection, SockJSRouter
+import state_sync
+import wire
+from scheduler import BroadcastScheduler
+
+CERTFILE = './certificate.crt'
+KEYFILE = './privateKey.key'
+HIGH_WATER = 1 << 22
+DRAIN_MS = 100
+
+def track_writes(handler):
+    """Subclass of a websocket handler counting the bytes of its writes
+    that haven't completed, from the futures write_message returns
+
+    Other handlers are returned as they are.
+    """
+    if not issubclass(handler, websocket.WebSocketHandler):
+        return handler
+    def write_message(self, message, binary=False):
+        future = handler.write_message(self, message, binary)
+        n = len(message.encode('utf-8') if not isinstance(message, bytes)
+                                                                else message)
+        self.queued_bytes += n
+        def done(f):
+            self.queued_bytes -= n
+        future.add_done_callback(done)
+        return future
+    return type(handler.__name__, (handler,),
+                {'write_message': write_message, 'queued_bytes': 0})
+
+def queued_bytes(conn):
+    """Bytes sent to a client but not yet written to its socket
+
+    Counts the sockjs session's send queue (polling transports, or a
+    websocket between reconnects) & the pending writes of a websocket
+    (see `track_writes`).
+    """
+    session = conn.session
+    n = len(getattr(session, 'send_queue', ''))
+    handler = getattr(session, 'handler', None)
+    if isinstance(handler, websocket.WebSocketHandler):
+        n += handler.queued_bytes
+    return n
+
+class Connection(SockJSConnection):
+    """Websocket of one neuroglancer client
+
+    `Session` subclasses this with ng_session set to itself.
+    """
+    ng_session = None
+
+    def on_open(self, info):
+        self.ng_session.clients.add(self)
+
+    def on_message(self, message):
+        self.ng_session.receive(self, message)
+
+    def on_close(self):
+        self.ng_session.clients.discard(self)
+
+class Session(object):
+
+    def __init__(self, name='', io_loop=None, compress=False,
+                 pack_points=False, record=None, lazy=False):
+        """Neuroglancer state shared by the clients of one tool session
+
+        Clients connect with 'stateURL':'https://host:port/<name>'. Inbound
+        states are passed to the handlers on the IOLoop thread; other threads
+        (e.g. Tk) should edit the state inside `edit`, or at least call
+        `broadcast` after changing it. All access to state goes through lock.
+
+        Args:
+            name: URL prefix of the session
+            io_loop: IOLoop the session's pushes run on
+            compress: let websocket clients negotiate permessage-deflate
+            pack_points: send the points of point layers packed as base64
+                int32 (see `wire.pack_state`); needs a client that reads them
+            record: file to append inbound messages to, one per line (for
+                `codec.benchmark`)
+            lazy: decode inbound states lazily, so handlers only pay for the
+                sections they read (see `lazy_json.LazyDict`). Handlers then
+                get a Mapping rather than a dict; encode it with
+                `lazy_json.dumps`. Off by default: with orjson a full decode
+                is about as fast.
+
+        Attributes:
+            state: latest state dict (None until the first client message)
+            n_messages: number of states received
+            clients: open connections
+            handlers: functions handler(state, first) called on each inbound
+                state, first is True for the very first one. If any returns
+                a true value, the state is broadcast back.
+            lock: re-entrant lock guarding state
+            router: SockJSRouter serving the session
+            scheduler: BroadcastScheduler coalescing pushes
+            urls: Tornado handlers of the session
+            bytes_sent: bytes of state messages sent, over all clients
+            high_water: queued bytes above which a client is skipped
+            dropped_frames: pushes skipped for slow clients
+        """
+        self.name = name
+        self.state = None
+        self.n_messages = 0
+        self.clients = set()
+        self.handlers = []
+        self.lock = threading.RLock()
+        conn = type('Connection', (Connection,), {'ng_session': self})
+        self.router = SockJSRouter(conn, '/' + name if name else '')
+        self.urls = [(p, track_writes(h), kw) for p, h, kw in self.router.urls]
+        if compress:
+            self.urls = [(p, wire.compressed(h), kw) for p, h, kw in self.urls]
+        self.pack_points = pack_points
+        self.bytes_sent = 0
+        self.record = record
+        self.lazy = lazy
+        self.high_water = HIGH_WATER
+        self.dropped_frames = 0
+        self.scheduler = BroadcastScheduler(self.push, io_loop=io_loop)
+        self.drainer = ioloop.PeriodicCallback(self.drain, DRAIN_MS)
+        self.scheduler.io_loop.add_callback(self.drainer.start)
+
+    def add_handler(self, handler):
+        """Call handler(state, first) on every inbound state (see `Session`)
+        """
+        self.handlers.append(handler)
+        return handler
+
+    def receive(self, conn, message):
+        if self.record:
+            with open(self.record, 'a') as f:
+                f.write(message + '\n')
+        state = state_sync.receive(conn, message, self.lazy)
+        if state is None:
+            return
+        with self.lock:
+            self.state = state
+            first = self.n_messages == 0
+            self.n_messages += 1
+            changed = False
+            for handler in self.handlers:
+                if handler(state, first):
+                    changed = True
+        if changed:
+            self.broadcast()
+
+    @contextmanager
+    def edit(self):
+        """Hold the lock while editing the state, then broadcast it
+
+            with session.edit() as state:
+                state['layers']['segmentation']['segments'] = segs
+        """
+        with self.lock:
+            yield self.state
+        self.broadcast()
+
+    def broadcast(self):
+        """Push the state to all clients soon (thread-safe, coalesced)
+        """
+        self.scheduler.request()
+
+    def push(self):
+        with self.lock:
+            if self.state is None:
+                return False
+            state = self.state
+            if self.pack_points:
+                state = wire.pack_state(state)
+            ready = []
+            for conn in self.clients:
+                if queued_bytes(conn) > self.high_water:
+                    # only the newest state matters: resend it in full once
+                    # the client has caught up (see `drain`)
+                    conn.view = None
+                    conn.stale = True
+                    self.dropped_frames += 1
+                else:
+                    conn.stale = False
+                    ready.append(conn)
+            self.bytes_sent += state_sync.broadcast(self.router, ready, state)
+
+    def drain(self):
+        """Push to slow clients whose queues fell below high_water
+        """
+        for conn in list(self.clients):
+            if getattr(conn, 'stale', False) and \
+                    queued_bytes(conn) <= self.high_water:
+                self.broadcast()
+                return
+
+    def stats(self):
+        """Counters of the session & bytes queued per client
+        """
+        s = self.scheduler.stats()
+        s.update({'bytes_sent': self.bytes_sent,
+                  'dropped_frames': self.dropped_frames,
+                  'queued_bytes': [queued_bytes(c) for c in list(self.clients)]})
+        return s
+
+class StateServer(object):
+
+    def __init__(self, port=9999, certfile=CERTFILE, keyfile=KEYFILE,
+                 compress=False, pack_points=False, record=None, lazy=False):
+        """HTTP(S) server hosting any number of neuroglancer state sessions
+
+        Tornado & Tk need to run on separate threads: `start` runs the
+        IOLoop on a daemon thread.
+
+        Args:
+            port: port to listen on
+            certfile: SSL certificate; None to serve plain HTTP
+            keyfile: SSL private key
+            compress, pack_points: wire encoding of sessions (see `Session`)
+            record, lazy: inbound messages of sessions (see `Session`)
+        """
+        self.port = port
+        self.certfile = certfile
+        self.keyfile = keyfile
+        self.compress = compress
+        self.pack_points = pack_points
+        self.record = record
+        self.lazy = lazy
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.io_loop = ioloop.IOLoop.instance()
+        self.app = web.Application([])
+        self.thread = None
+
+    def session(self, name=''):
+        """Return the session served at /name, creating it if needed
+        """
+        with self.lock:
+            if name not in self.sessions:
+                s = Session(name, self.io_loop, self.compress,
+                            self.pack_points, self.record, self.lazy)
+                self.app.add_handlers(r'.*$', s.urls)
+                self.sessions[name] = s
+            return self.sessions[name]
+
+    def start(self):
+        ssl_options = None
+        if self.certfile:
+            ssl_options = {"certfile": self.certfile, "keyfile": self.keyfile}
+        http_server = httpserver.HTTPServer(self.app, ssl_options=ssl_options)
+        http_server.bind(self.port)
+        http_server.start(1)
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        print("IOLoop starting")
+        self.io_loop.start()
@@ -0,0 +1,166 @@
+import codec
+import lazy_json
+from lazy_json import LazyDict
+
+def snapshot(state):
+    """Copy of a state that later edits of the original can't reach
+
+    Dicts are copied recursively; lists are copied shallowly, so nested
+    lists (e.g. point coordinates) are shared. Controllers replace such
+    lists rather than editing them in place, which is all a snapshot needs.
+    LazyDicts share their raw JSON with the snapshot.
+    """
+    if isinstance(state, LazyDict):
+        return state.copy(snapshot)
+    if isinstance(state, dict):
+        return state.__class__((k, snapshot(v)) for k, v in state.items())
+    if isinstance(state, list):
+        return list(state)
+    return state
+
+def escape(key):
+    """JSON pointer token of a dict key
+    """
+    return key.replace('~', '~0').replace('/', '~1')
+
+def unescape(token):
+    return token.replace('~1', '/').replace('~0', '~')
+
+def diff(old, new, path=''):
+    """JSON-patch ops (add, remove, replace) turning old into new
+
+    Dicts are diffed key by key; any other changed value, lists included,
+    is replaced whole. Members of LazyDicts that are untouched & have the
+    same raw JSON on both sides are skipped without being decoded.
+
+    Returns:
+        list of op dicts, empty if the states are equal
+    """
+    if is_object(old) and is_object(new):
+        ops = []
+        for k in old:
+            if k not in new:
+                ops.append({'op': 'remove', 'path': path + '/' + escape(k)})
+        for k in new:
+            p = path + '/' + escape(k)
+            if k not in old:
+                ops.append({'op': 'add', 'path': p, 'value': new[k]})
+            elif not (isinstance(new, LazyDict) and new.same_raw(old, k)):
+                ops.extend(diff(old[k], new[k], p))
+        return ops
+    if type(old) is not type(new) or old != new:
+        return [{'op': 'replace', 'path': path, 'value': new}]
+    return []
+
+def apply_patch(state, ops):
+    """Apply JSON-patch ops (see `diff`) to state, in place
+
+    Returns:
+        patched state (a new object if the root itself was replaced)
+
+    Raises:
+        KeyError, IndexError, ValueError or TypeError if an op doesn't fit
+    """
+    for op in ops:
+        if op['path'] == '':
+            state = op['value']
+            continue
+        tokens = [unescape(t) for t in op['path'].split('/')[1:]]
+        parent = state
+        for t in tokens[:-1]:
+            parent = parent[int(t) if isinstance(parent, list) else t]
+        k = tokens[-1]
+        if isinstance(parent, list):
+            k = int(k)
+        if op['op'] == 'remove':
+            del parent[k]
+        elif op['op'] in ('add', 'replace'):
+            parent[k] = op['value']
+        else:
+            raise ValueError('unsupported patch op ' + op['op'])
+    return state
+
+def is_object(x):
+    return isinstance(x, (dict, LazyDict))
+
+def is_patch(msg):
+    return is_object(msg) and len(msg) == 1 and 'patch' in msg
+
+def receive(conn, message, lazy=False):
+    """Decode an inbound message into the full state of the sending client
+
+    Messages are either a full state (what neuroglancer sends) or
+    {"patch": [ops]} relative to the state the server last sent or received
+    on conn. A client that sends a patch is answered with patches too. If a
+    patch doesn't apply, the client is out of sync: None is returned & the
+    next broadcast sends it the full state.
+
+    Args:
+        conn: SockJSConnection the message came in on
+        message: JSON string
+        lazy: decode the state as a LazyDict (see `lazy_json`)
+
+    Returns:
+        state dict (owned by the caller), or None
+    """
+    msg = lazy_json.loads(message) if lazy else codec.loads(message)
+    if is_patch(msg):
+        conn.delta = True
+        view = getattr(conn, 'view', None)
+        try:
+            if view is None:
+                raise KeyError('no state to patch')
+            state = apply_patch(snapshot(view), msg['patch'])
+        except (KeyError, IndexError, ValueError, TypeError) as err:
+            print('state patch failed (' + repr(err) + '), resyncing')
+            conn.view = None
+            return None
+    else:
+        state = msg
+    conn.view = snapshot(state)
+    return state
+
+def broadcast(router, clients, state):
+    """Send state to clients, only as far as it differs from their view
+
+    Clients that already show state get nothing. Clients that sent patches
+    get the patch from their view, other clients (& clients without a known
+    view) get the full state. Each distinct message is encoded once.
+
+    Args:
+        router: SockJSRouter
+        clients: iterable of connections
+        state: current state
+
+    Returns:
+        number of bytes sent, over all clients
+    """
+    snap = snapshot(state)
+    patches = {}
+    full = []
+    for conn in list(clients):
+        view = getattr(conn, 'view', None)
+        conn.view = snap
+        if view is None:
+            full.append(conn)
+            continue
+        if id(view) not in patches:
+            patches[id(view)] = (diff(view, snap), [], view)
+        ops, conns, _ = patches[id(view)]
+        if not ops:
+            continue
+        if getattr(conn, 'delta', False):
+            conns.append(conn)
+        else:
+            full.append(conn)
+    n = 0
+    for ops, conns, _ in patches.values():
+        if ops and conns:
+            msg = lazy_json.dumps({'patch': ops})
+            router.broadcast(conns, msg)
+            n += len(msg.encode('utf-8')) * len(conns)
+    if full:
+        msg = lazy_json.dumps(state)
+        router.broadcast(full, msg)
+        n += len(msg.encode('utf-8')) * len(full)
+    return n
@@ -1,4 +1,5 @@
 from edges import Edges
+from columnar_edges import ColumnarEdges
 import copy
 import h5py
 import numpy as np
@@ -45,9 +46,18 @@ class Segment(object):
 
 class Model(object):
 
-    def __init__(self, src_file, dst_file):
+    def __init__(self, src_file, dst_file, columnar=False, cache=False,
+                                                            journaled=False):
         """Model object governs the edge dictionaries
 
+        Args:
+            columnar: use the numpy column backend (ColumnarEdges), which
+                holds large edge tables in a fraction of the memory
+            cache: reopen the parsed edges from a memory-mapped sidecar
+                (written to <src_file>.cache/ on first load)
+            journaled: save appends edits to a journal instead of rewriting
+                dst_file (see `compact`)
+
         Attributes:
             edges: Edges object with all edge dictionaries
 
@@ -58,7 +68,12 @@ class Model(object):
             current_segment: ID of segment being viewed
             segment_idx: index of current segment
         """
-        self.edges = Edges(src_file, dst_file)
+        if columnar:
+            self.edges = ColumnarEdges(src_file, dst_file, cache=cache,
+                                                        journaled=journaled)
+        else:
+            self.edges = Edges(src_file, dst_file, cache=cache,
+                                                        journaled=journaled)
         self.segments = []
         self.synapses = {'pre': [], 'post': [], 'shared': []}
         self.coords = {'pre': [], 'post': [], 'shared': []}
@@ -169,8 +184,7 @@ class Model(object):
                     syn_to_remove[i] = False
                     syn_to_add[j] = False
 
-        for syn in np.array(old_synapses)[syn_to_remove]:
-            self.edges.remove_edge(syn)
+        self.edges.remove_edges(np.array(old_synapses)[syn_to_remove])
 
         if sum(syn_to_add) > 0:
             print('There are new synapses. Use model.add_edge() ' + 
@@ -199,11 +213,24 @@ class Model(object):
     def undo(self):
         self.edges.undo()
 
+    def redo(self):
+        self.edges.redo()
+
     def save(self):
         """Write update edges csv to outfile
         """
         self.edges.save()
 
+    def compact(self):
+        """Merge the edit journal into a full edges csv at outfile
+
+        Without a journal, save already writes the full csv.
+        """
+        if self.edges.journal is None:
+            self.save()
+            return
+        self.edges.compact_journal()
+
     def __repr__(self):
         s  = 'no\tsyn\tcentroid\t\tpre\t\tpost\n'
         syn_coord = zip(self.get_synapses(), self.get_coords())
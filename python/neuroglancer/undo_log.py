@@ -0,0 +1,137 @@
+import numpy as np
+from contextlib import contextmanager
+
+REMOVE = 0
+ADD = 1
+UNDO_BYTES = 1 << 26
+
+FIELDS = [('op', np.int8, ()), ('group', np.int64, ()), ('syn', np.int64, ()),
+          ('pre', np.int64, ()), ('post', np.int64, ()),
+          ('center', np.int32, (3,)), ('size', np.int64, ()),
+          ('pre_coord', np.int32, (3,)), ('post_coord', np.int32, (3,))]
+
+class UndoLog(object):
+
+    def __init__(self, max_bytes=UNDO_BYTES):
+        """Bounded undo/redo history of synapse edits
+
+        Edits are fixed-width records kept as a struct of numpy arrays used as
+        a ring buffer, so the history costs a fixed max_bytes no matter how
+        long the session runs. When full, the oldest group of records is
+        evicted. Records pushed inside `transaction` share a group & are
+        undone/redone together.
+
+        Positions are absolute record counts: records in [start, cursor) can
+        be undone, records in [cursor, end) can be redone.
+
+        Args:
+            max_bytes: memory cap of the history
+        """
+        record_bytes = sum(np.dtype(t).itemsize * int(np.prod(s))
+                                                        for _, t, s in FIELDS)
+        self.capacity = max(1, max_bytes // record_bytes)
+        self.arrays = dict((k, np.zeros((self.capacity,) + s, dtype=t))
+                                                        for k, t, s in FIELDS)
+        self.start = 0
+        self.cursor = 0
+        self.end = 0
+        self.groups = 0
+        self.depth = 0
+        self.dropped = None
+
+    @contextmanager
+    def transaction(self):
+        """Group all records pushed inside the block into one undo step
+        """
+        if self.depth == 0:
+            self.groups += 1
+        self.depth += 1
+        try:
+            yield
+        finally:
+            self.depth -= 1
+
+    def push(self, op, syn, pre, post, center, size, pre_coord, post_coord):
+        """Record an applied edit, discarding any redo history
+        """
+        if self.depth == 0:
+            self.groups += 1
+        group = self.groups
+        if group == self.dropped:
+            return
+        self.end = self.cursor
+        if self.end - self.start == self.capacity:
+            self._evict(group)
+            if group == self.dropped:
+                return
+        i = self.end % self.capacity
+        a = self.arrays
+        a['op'][i] = op
+        a['group'][i] = group
+        a['syn'][i] = syn
+        a['pre'][i] = pre
+        a['post'][i] = post
+        a['center'][i] = center
+        a['size'][i] = size
+        a['pre_coord'][i] = pre_coord
+        a['post_coord'][i] = post_coord
+        self.end += 1
+        self.cursor = self.end
+
+    def _evict(self, group):
+        """Drop the oldest group. If that is the group being recorded, it
+        can't be undone as a whole, so the history is cleared instead.
+        """
+        g = self.arrays['group'][self.start % self.capacity]
+        if g == group:
+            print('edit too large for undo history (' + str(self.capacity) +
+                                                ' records); history cleared')
+            self.dropped = group
+            self.start = self.cursor = self.end
+            return
+        while self.start < self.end and \
+                self.arrays['group'][self.start % self.capacity] == g:
+            self.start += 1
+
+    def _record(self, j):
+        i = j % self.capacity
+        a = self.arrays
+        return (int(a['op'][i]), int(a['syn'][i]), int(a['pre'][i]),
+                int(a['post'][i]), a['center'][i].tolist(), int(a['size'][i]),
+                a['pre_coord'][i].tolist(), a['post_coord'][i].tolist())
+
+    def undo(self):
+        """Step back one group
+
+        Returns:
+            list of record tuples (op, syn, pre, post, center, size,
+            pre_coord, post_coord), newest first, to be reverted in order
+        """
+        records = []
+        if self.cursor > self.start:
+            g = self.arrays['group'][(self.cursor - 1) % self.capacity]
+            while self.cursor > self.start and \
+                    self.arrays['group'][(self.cursor - 1) % self.capacity] == g:
+                self.cursor -= 1
+                records.append(self._record(self.cursor))
+        return records
+
+    def redo(self):
+        """Step forward one group
+
+        Returns:
+            list of record tuples, oldest first, to be reapplied in order
+        """
+        records = []
+        if self.cursor < self.end:
+            g = self.arrays['group'][self.cursor % self.capacity]
+            while self.cursor < self.end and \
+                    self.arrays['group'][self.cursor % self.capacity] == g:
+                records.append(self._record(self.cursor))
+                self.cursor += 1
+        return records
+
+    def __len__(self):
+        """Number of records that can be undone
+        """
+        return self.cursor - self.start
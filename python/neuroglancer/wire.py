@@ -0,0 +1,82 @@
+import zlib
+import base64
+import numpy as np
+from tornado import websocket
+import lazy_json
+from state_sync import is_object
+
+POINT_DTYPE = '<i4'
+
+def pack_points(points):
+    """Pack Nx3 coordinates into base64 little-endian int32
+
+    Returns:
+        {'dtype': 'int32', 'shape': [N, 3], 'data': base64 string}
+    """
+    a = round_points(points).astype(POINT_DTYPE)
+    return {'dtype': 'int32', 'shape': list(a.shape),
+            'data': base64.b64encode(a.tobytes()).decode('ascii')}
+
+def is_packed(points):
+    return isinstance(points, dict) and 'data' in points
+
+def round_points(points):
+    """Round coordinates half away from zero, as int64 Nx3 array
+    """
+    a = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    return (np.sign(a) * np.floor(np.abs(a) + 0.5)).astype(np.int64)
+
+def unpack_points(points):
+    """Integer Nx3 array of a points layer's points, packed (see
+    `pack_points`) or as the nested lists neuroglancer sends
+    """
+    if is_packed(points):
+        a = np.frombuffer(base64.b64decode(points['data']), dtype=POINT_DTYPE)
+        return a.reshape(points['shape']).astype(np.int64)
+    return round_points(points)
+
+def pack_state(state):
+    """Copy of state with the points of point layers packed
+
+    Only the containers on the way to packed points are copied; the rest
+    of the state is shared.
+    """
+    layers = state.get('layers') if is_object(state) else None
+    if not is_object(layers):
+        return state
+    new_layers = None
+    for k in layers:
+        layer = layers[k]
+        if is_object(layer) and layer.get('type') == 'point' and \
+                isinstance(layer.get('points'), list) and layer['points']:
+            if new_layers is None:
+                new_layers = layers.copy()
+            new_layers[k] = layer.copy()
+            new_layers[k]['points'] = pack_points(layer['points'])
+    if new_layers is None:
+        return state
+    state = state.copy()
+    state['layers'] = new_layers
+    return state
+
+def measure(state):
+    """Bytes on the wire of a state message, plain & packed, with & without
+    deflate (approximating permessage-deflate)
+
+    Returns:
+        dict of byte counts
+    """
+    plain = lazy_json.dumps(state).encode('utf-8')
+    packed = lazy_json.dumps(pack_state(state)).encode('utf-8')
+    return {'json': len(plain), 'json_deflate': len(zlib.compress(plain)),
+            'packed': len(packed), 'packed_deflate': len(zlib.compress(packed))}
+
+def compressed(handler):
+    """Subclass of a websocket handler that accepts permessage-deflate
+
+    Other handlers are returned as they are.
+    """
+    if not issubclass(handler, websocket.WebSocketHandler):
+        return handler
+    return type(handler.__name__, (handler,),
+                {'get_compression_options': lambda self: {}})